@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Agendamento justo das conversões entre clientes
+
+Cada conversão recebe um custo estimado (duração × fator de custo do codec
+em FORMATOS_SAIDA) e entra em uma fila de weighted fair queuing por cliente
+(chave de API ou IP). Assim, um cliente enviando vários arquivos longos não
+atrasa quem envia trechos curtos, e cada cliente tem um limite de conversões
+em andamento.
+
+O agendador é thread-safe e pode ser usado tanto pelo servidor Flask
+(reservar) quanto pelo servidor ASGI (reservar_async).
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+# Bytes por segundo assumidos quando a duração não pôde ser obtida pelo probe (~128 kbps)
+BYTES_POR_SEGUNDO_PADRAO = 16000
+
+# Custo mínimo, para que arquivos muito curtos ou sem duração também avancem o tempo virtual
+CUSTO_MINIMO = 0.1
+
+
+def estimar_custo(duracao, config_saida, tamanho_bytes=None):
+    """
+    Estima o custo de uma conversão antes de executá-la
+
+    Args:
+        duracao: Duração em segundos obtida pelo probe (ou None)
+        config_saida: Entrada de FORMATOS_SAIDA do formato de destino
+        tamanho_bytes: Tamanho do arquivo, usado se a duração for desconhecida
+
+    Returns:
+        Custo estimado (segundos de áudio ponderados pelo fator do codec)
+    """
+    if not duracao or duracao <= 0:
+        duracao = (tamanho_bytes or 0) / BYTES_POR_SEGUNDO_PADRAO
+    return max(CUSTO_MINIMO, duracao * config_saida.get('custo', 1.0))
+
+
+def identificar_cliente(headers, endereco_remoto, chaves_validas=(), proxies_confiaveis=0):
+    """
+    Identifica o cliente pela chave de API ou, na falta dela, pelo IP
+
+    Os cabeçalhos são controlados por quem faz a requisição, então só são
+    usados quando podem ser verificados; do contrário, qualquer um viraria um
+    "cliente novo" a cada requisição e escaparia dos limites por cliente.
+
+    Args:
+        headers: Cabeçalhos da requisição
+        endereco_remoto: IP da conexão
+        chaves_validas: Chaves de API configuradas; outras chaves são ignoradas
+        proxies_confiaveis: Número de proxies reversos confiáveis na frente do
+            servidor. Com 0, o X-Forwarded-For é ignorado
+    """
+    chave = headers.get('X-API-Key')
+    if chave and chave in chaves_validas:
+        return f'chave:{chave}'
+    encaminhado = headers.get('X-Forwarded-For')
+    if encaminhado and proxies_confiaveis > 0:
+        # Cada proxy acrescenta à direita o endereço de quem o chamou
+        enderecos = [e.strip() for e in encaminhado.split(',') if e.strip()]
+        if len(enderecos) >= proxies_confiaveis:
+            return f'ip:{enderecos[-proxies_confiaveis]}'
+    return f'ip:{endereco_remoto or "desconhecido"}'
+
+
+class _Tarefa:
+    __slots__ = ('cliente', 'codec', 'inicio', 'fim', 'notificar', 'estado')
+
+    def __init__(self, cliente, codec, inicio, fim, notificar):
+        self.cliente = cliente
+        self.codec = codec
+        self.inicio = inicio
+        self.fim = fim
+        self.notificar = notificar
+        self.estado = 'fila'
+
+
+class AgendadorJusto:
+    """
+    Fila justa ponderada (WFQ) com limite global, por cliente e por codec
+
+    Cada tarefa recebe as marcas virtuais inicio = max(V, fim anterior do
+    cliente) e fim = inicio + custo / peso. Sempre que há capacidade livre,
+    é liberada a tarefa com menor marca de fim entre os clientes que ainda
+    não atingiram o limite de conversões em andamento (e cujo codec não
+    atingiu o paralelismo definido no perfil do autotune).
+    """
+
+    def __init__(self, capacidade, limite_por_cliente, limites_por_codec=None):
+        self.capacidade = max(1, int(capacidade))
+        self.limite_por_cliente = max(1, int(limite_por_cliente))
+        self.limites_por_codec = dict(limites_por_codec or {})
+        self._em_execucao_codec = {}
+        self._lock = threading.Lock()
+        self._fila = []
+        self._sequencia = itertools.count()
+        self._tempo_virtual = 0.0
+        self._ultimo_fim = {}
+        self._em_execucao = {}
+        self._na_fila = {}
+        self._ativas = 0
+
+    def _enfileirar(self, cliente, custo, notificar, codec=None, peso=1.0):
+        with self._lock:
+            inicio = max(self._tempo_virtual, self._ultimo_fim.get(cliente, 0.0))
+            fim = inicio + custo / peso
+            self._ultimo_fim[cliente] = fim
+            self._na_fila[cliente] = self._na_fila.get(cliente, 0) + 1
+            tarefa = _Tarefa(cliente, codec, inicio, fim, notificar)
+            heapq.heappush(self._fila, (fim, next(self._sequencia), tarefa))
+            self._despachar()
+        return tarefa
+
+    def _despachar(self):
+        """Libera tarefas enquanto houver capacidade (chamado com o lock adquirido)"""
+        adiadas = []
+        while self._ativas < self.capacidade and self._fila:
+            item = heapq.heappop(self._fila)
+            tarefa = item[2]
+            if tarefa.estado != 'fila':
+                continue
+            limite_codec = self.limites_por_codec.get(tarefa.codec, self.capacidade)
+            if (self._em_execucao.get(tarefa.cliente, 0) >= self.limite_por_cliente
+                    or self._em_execucao_codec.get(tarefa.codec, 0) >= limite_codec):
+                adiadas.append(item)
+                continue
+            tarefa.estado = 'executando'
+            self._na_fila[tarefa.cliente] -= 1
+            self._em_execucao[tarefa.cliente] = self._em_execucao.get(tarefa.cliente, 0) + 1
+            self._em_execucao_codec[tarefa.codec] = self._em_execucao_codec.get(tarefa.codec, 0) + 1
+            self._ativas += 1
+            self._tempo_virtual = max(self._tempo_virtual, tarefa.inicio)
+            tarefa.notificar()
+        for item in adiadas:
+            heapq.heappush(self._fila, item)
+
+    def _liberar(self, tarefa):
+        with self._lock:
+            if tarefa.estado != 'executando':
+                return
+            tarefa.estado = 'concluida'
+            self._ativas -= 1
+            self._em_execucao[tarefa.cliente] -= 1
+            self._em_execucao_codec[tarefa.codec] -= 1
+            self._esquecer_cliente(tarefa.cliente)
+            self._despachar()
+
+    def _cancelar(self, tarefa):
+        """Remove uma tarefa ainda na fila. Retorna False se ela já foi liberada"""
+        with self._lock:
+            if tarefa.estado != 'fila':
+                return False
+            tarefa.estado = 'cancelada'
+            self._na_fila[tarefa.cliente] -= 1
+            self._esquecer_cliente(tarefa.cliente)
+            return True
+
+    def _esquecer_cliente(self, cliente):
+        # Cliente sem tarefas em execução nem na fila não precisa de estado: se voltar,
+        # recomeça em max(V, ...) como um cliente novo. Sem isso, cada IP/chave já visto
+        # ficaria para sempre nos dicionários (a marca de fim raramente é alcançada por V)
+        if self._em_execucao.get(cliente, 0) == 0 and self._na_fila.get(cliente, 0) == 0:
+            self._em_execucao.pop(cliente, None)
+            self._na_fila.pop(cliente, None)
+            self._ultimo_fim.pop(cliente, None)
+
+    @contextmanager
+    def reservar(self, cliente, custo, codec=None):
+        """Aguarda (bloqueando a thread) a vez do cliente e ocupa uma vaga de conversão"""
+        evento = threading.Event()
+        tarefa = self._enfileirar(cliente, custo, evento.set, codec)
+        evento.wait()
+        try:
+            yield
+        finally:
+            self._liberar(tarefa)
+
+    @asynccontextmanager
+    async def reservar_async(self, cliente, custo, codec=None):
+        """Aguarda (sem bloquear o event loop) a vez do cliente e ocupa uma vaga de conversão"""
+        loop = asyncio.get_running_loop()
+        liberada = loop.create_future()
+
+        def resolver():
+            if not liberada.done():
+                liberada.set_result(None)
+
+        tarefa = self._enfileirar(cliente, custo, lambda: loop.call_soon_threadsafe(resolver), codec)
+        try:
+            await liberada
+        except asyncio.CancelledError:
+            # Cliente desconectou enquanto aguardava: sai da fila ou devolve a vaga
+            if not self._cancelar(tarefa):
+                self._liberar(tarefa)
+            raise
+        try:
+            yield
+        finally:
+            self._liberar(tarefa)
@@ -13,9 +13,21 @@ import tempfile
 import uuid
 import re
 from pathlib import Path
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
 from flask_cors import CORS
 import ffmpeg
+from conversor_audio import (
+    montar_conversao, duracao_do_probe, duracao_trecho, interpretar_tempo, interpretar_duracao,
+    validar_inicio, interpretar_tamanho, calcular_bitrate_alvo, revisar_bitrate_alvo, reduzir_bitrate_alvo,
+    mensagem_tamanho_excedido, PERFIL_AJUSTE,
+    limitar_preview, medir_loudness, loudness_em_cache, CUSTO_LOUDNESS,
+    FORMATOS_SAIDA as FORMATOS_CONVERSAO
+)
+from agendador import AgendadorJusto, estimar_custo, identificar_cliente
+from cache_audio import hash_arquivo
+from picos import (
+    CUSTO_PICOS, calcular_picos, ler_resolucao, picos_binarios, picos_em_cache
+)
 
 app = Flask(__name__)
 
@@ -33,6 +45,29 @@ EDGE_UPLOAD_LIMIT_MB = _to_float(
     MAX_UPLOAD_SIZE_MB
 )
 
+# Máximo de conversões FFmpeg simultâneas (CPU), independente do número de conexões
+LIMITE_CONVERSOES = max(1, int(_to_float(
+    os.environ.get('MAX_CONVERSOES_SIMULTANEAS', os.cpu_count() or 1),
+    os.cpu_count() or 1
+)))
+
+# Máximo de conversões em andamento por cliente (chave de API ou IP)
+LIMITE_POR_CLIENTE = max(1, int(_to_float(os.environ.get('MAX_CONVERSOES_POR_CLIENTE', '2'), 2)))
+
+# Chaves de API aceitas para identificar clientes (separadas por vírgula); outras são ignoradas
+CHAVES_API = frozenset(c.strip() for c in os.environ.get('API_KEYS', '').split(',') if c.strip())
+
+# Proxies reversos confiáveis na frente do servidor; sem eles o X-Forwarded-For é ignorado
+PROXIES_CONFIAVEIS = max(0, int(_to_float(os.environ.get('TRUSTED_PROXY_HOPS', '0'), 0)))
+
+# Fila justa entre clientes, compartilhada pelos servidores WSGI e ASGI.
+# O paralelismo por codec vem do perfil gerado por autotune.py (se existir)
+agendador = AgendadorJusto(
+    LIMITE_CONVERSOES,
+    LIMITE_POR_CLIENTE,
+    {acodec: ajuste['concorrencia'] for acodec, ajuste in PERFIL_AJUSTE.items()}
+)
+
 app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_SIZE_MB * 1024 * 1024)
 
 # Configura CORS para permitir todas as origens e métodos
@@ -44,7 +79,7 @@ CORS(app, resources={
     }
 })
 # Também configura CORS globalmente como fallback
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=['X-Audio-Hash', 'X-Peaks-Buckets', 'X-Audio-Duration'])
 
 # Configurações
 FFMPEG_BINARY = os.environ.get('FFMPEG_PATH', 'ffmpeg')
@@ -64,21 +99,28 @@ FORMATOS_ENTRADA = {
     'raw', 'rf64', 'sln', 'vox', 'webm'
 }
 
+# Os dados de cada codec (acodec, extensão, custo no agendador, limites de bitrate) vêm de
+# conversor_audio.FORMATOS_SAIDA; o servidor só acrescenta o mimetype da resposta
+MIMETYPES_SAIDA = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+    'aac': 'audio/aac',
+    'm4a': 'audio/mp4',
+    'opus': 'audio/opus',
+    'wma': 'audio/x-ms-wma',
+    'aiff': 'audio/aiff',
+    'aif': 'audio/aiff',
+    'ac3': 'audio/ac3',
+    'mp2': 'audio/mpeg',
+    'amr': 'audio/amr',
+    'webm': 'audio/webm'
+}
+
 FORMATOS_SAIDA = {
-    'mp3': {'acodec': 'libmp3lame', 'ext': 'mp3', 'mimetype': 'audio/mpeg'},
-    'wav': {'acodec': 'pcm_s16le', 'ext': 'wav', 'mimetype': 'audio/wav'},
-    'flac': {'acodec': 'flac', 'ext': 'flac', 'mimetype': 'audio/flac'},
-    'ogg': {'acodec': 'libvorbis', 'ext': 'ogg', 'mimetype': 'audio/ogg'},
-    'aac': {'acodec': 'aac', 'ext': 'aac', 'mimetype': 'audio/aac'},
-    'm4a': {'acodec': 'aac', 'ext': 'm4a', 'mimetype': 'audio/mp4'},
-    'opus': {'acodec': 'libopus', 'ext': 'opus', 'mimetype': 'audio/opus'},
-    'wma': {'acodec': 'wmav2', 'ext': 'wma', 'mimetype': 'audio/x-ms-wma'},
-    'aiff': {'acodec': 'pcm_s16be', 'ext': 'aiff', 'mimetype': 'audio/aiff'},
-    'aif': {'acodec': 'pcm_s16be', 'ext': 'aif', 'mimetype': 'audio/aiff'},
-    'ac3': {'acodec': 'ac3', 'ext': 'ac3', 'mimetype': 'audio/ac3'},
-    'mp2': {'acodec': 'mp2', 'ext': 'mp2', 'mimetype': 'audio/mpeg'},
-    'amr': {'acodec': 'libopencore_amrnb', 'ext': 'amr', 'mimetype': 'audio/amr'},
-    'webm': {'acodec': 'libopus', 'ext': 'webm', 'mimetype': 'audio/webm'}
+    formato: {**config, 'mimetype': MIMETYPES_SAIDA[formato]}
+    for formato, config in FORMATOS_CONVERSAO.items()
 }
 
 ALLOWED_EXTENSIONS = FORMATOS_ENTRADA
@@ -154,6 +196,81 @@ def detectar_formato(arquivo):
     return ext if ext in FORMATOS_ENTRADA else None
 
 
+def cliente_da_requisicao(headers, endereco_remoto):
+    """Identidade do cliente na fila justa, usando apenas chaves e proxies configurados"""
+    return identificar_cliente(headers, endereco_remoto, CHAVES_API, PROXIES_CONFIAVEIS)
+
+
+def valor_booleano(valor):
+    """Interpreta campos de formulário como '1', 'true', 'on' ou 'sim'"""
+    return str(valor or '').strip().lower() in {'1', 'true', 'on', 'sim', 'yes'}
+
+
+def ler_trecho(form):
+    """
+    Lê os campos start/duration/preview do formulário
+
+    Returns:
+        Tupla (inicio, duracao, preview)
+
+    Raises:
+        ValueError: Se start ou duration forem inválidos
+    """
+    inicio = interpretar_tempo(form.get('start'))
+    duracao = interpretar_duracao(form.get('duration'))
+    return inicio, duracao, valor_booleano(form.get('preview'))
+
+
+def ler_formato_picos(valor):
+    """Valida o formato de resposta dos picos ('json' ou 'bin')"""
+    formato = (valor or 'json').strip().lower()
+    if formato not in ('json', 'bin'):
+        raise ValueError("Formato de picos inválido. Use 'json' ou 'bin'")
+    return formato
+
+
+def hash_valido(valor):
+    """Verifica se o valor é um hash SHA-256 em hexadecimal"""
+    return bool(re.fullmatch(r'[0-9a-f]{64}', valor or ''))
+
+
+def calcular_picos_agendado(input_path, buckets):
+    """Calcula os picos do arquivo, passando pela fila justa apenas se não estiverem em cache"""
+    hash_conteudo = hash_arquivo(input_path)
+    dados = picos_em_cache(hash_conteudo, buckets)
+    if dados is None:
+        custo = estimar_custo(None, {'custo': CUSTO_PICOS}, os.path.getsize(input_path))
+        with agendador.reservar(cliente_da_requisicao(request.headers, request.remote_addr), custo):
+            dados = calcular_picos(input_path, buckets, FFMPEG_BINARY, hash_conteudo)
+    return dados
+
+
+def medir_loudness_agendado(input_path, inicio, duracao, duracao_medida, file_size):
+    """Mede o loudness do trecho, passando pela fila justa apenas se a medição não estiver em cache"""
+    hash_conteudo = hash_arquivo(input_path)
+    em_cache = loudness_em_cache(hash_conteudo, inicio, duracao)
+    if em_cache is not None:
+        return em_cache.get('medicao')
+    custo = estimar_custo(duracao_medida, {'custo': CUSTO_LOUDNESS}, file_size)
+    with agendador.reservar(cliente_da_requisicao(request.headers, request.remote_addr), custo):
+        return medir_loudness(input_path, inicio, duracao, FFMPEG_BINARY, hash_conteudo)
+
+
+def responder_picos(dados, formato):
+    """Monta a resposta com os picos em JSON ou binário (int16 min/max intercalados)"""
+    if formato == 'json':
+        return jsonify(dados)
+    return Response(
+        picos_binarios(dados),
+        mimetype='application/octet-stream',
+        headers={
+            'X-Audio-Hash': dados['hash'],
+            'X-Peaks-Buckets': str(dados['buckets']),
+            'X-Audio-Duration': str(dados['duration'])
+        }
+    )
+
+
 # Rotas de API devem vir antes das rotas de arquivos estáticos
 @app.route('/convert', methods=['POST', 'OPTIONS'])
 def convert():
@@ -190,6 +307,16 @@ def convert():
         quality = request.form.get('quality', '192k')
         formato_saida = request.form.get('format', 'm4a').lower().lstrip('.')
         
+        # Trecho opcional (start/duration) ou prévia rápida (preview=1)
+        try:
+            inicio, duracao_pedida, preview = ler_trecho(request.form)
+            tamanho_alvo = interpretar_tamanho(request.form.get('target_size'))
+            normalizar = valor_booleano(request.form.get('normalize'))
+            peaks = valor_booleano(request.form.get('peaks'))
+            buckets = ler_resolucao(request.form.get('buckets')) if peaks else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Verifica se o arquivo foi selecionado
         if file.filename == '':
             return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
@@ -215,7 +342,7 @@ def convert():
         
         # Gera o nome do arquivo de saída (mantém nome original para download)
         config_saida = FORMATOS_SAIDA[formato_saida]
-        output_filename = os.path.splitext(file.filename)[0] + '.' + config_saida['ext']
+        output_filename = os.path.splitext(file.filename)[0] + ('_preview' if preview else '') + '.' + config_saida['ext']
         safe_output_name = f"{uuid.uuid4().hex}.{config_saida['ext']}"
         output_path = os.path.join(OUTPUT_FOLDER, safe_output_name)
         
@@ -228,16 +355,26 @@ def convert():
             if file_size == 0:
                 return jsonify({'error': 'Arquivo de entrada está vazio'}), 400
             
+            # Picos da forma de onda (opcional): ficam em cache e são buscados depois via /api/peaks
+            dados_picos = None
+            if peaks:
+                try:
+                    dados_picos = calcular_picos_agendado(input_path, buckets)
+                except (RuntimeError, OSError) as peaks_error:
+                    print(f"Aviso: não foi possível calcular os picos: {str(peaks_error)[:300]}")
+            
             # Converte o arquivo - usa caminhos absolutos e entre aspas para evitar problemas com espaços
             input_path_abs = os.path.abspath(input_path)
             output_path_abs = os.path.abspath(output_path)
             
             # Verifica se o arquivo de entrada é realmente um arquivo de áudio válido (opcional)
             # Se ffprobe não estiver disponível, tenta converter mesmo assim
+            duracao = None
             try:
                 probe = ffmpeg.probe(input_path_abs)
                 if 'streams' not in probe or len(probe['streams']) == 0:
                     return jsonify({'error': 'Arquivo não contém streams de áudio válidos'}), 400
+                duracao = duracao_do_probe(probe)
             except (ffmpeg.Error, FileNotFoundError, OSError) as probe_error:
                 # Se ffprobe não estiver disponível, apenas loga e continua
                 # O FFmpeg pode converter mesmo sem o probe
@@ -250,31 +387,62 @@ def convert():
                     probe_msg = probe_error.stderr.decode('utf-8', errors='ignore') if hasattr(probe_error, 'stderr') and probe_error.stderr else str(probe_error)
                     print(f"Aviso ao fazer probe do arquivo: {probe_msg[:300]}. Tentando converter mesmo assim.")
             
-            stream = ffmpeg.input(input_path_abs)
+            try:
+                validar_inicio(inicio, duracao)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Prepara parâmetros de saída
-            output_params = {
-                'acodec': config_saida['acodec'],
-                'ac': 2,  # 2 canais (estéreo)
-                'ar': 44100  # Sample rate de 44.1kHz
-            }
+            # Modo tamanho alvo: bitrate calculado pela duração do trecho (ignorado na prévia)
+            bitrate_alvo = None
+            if tamanho_alvo and not preview:
+                try:
+                    bitrate_alvo = calcular_bitrate_alvo(
+                        tamanho_alvo, duracao_trecho(duracao, inicio, duracao_pedida), formato_saida
+                    )
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                quality = str(bitrate_alvo)
             
-            # Adiciona bitrate apenas para formatos comprimidos
-            formatos_sem_bitrate = {'wav', 'aiff', 'aif', 'flac'}
-            if formato_saida not in formatos_sem_bitrate:
-                output_params['audio_bitrate'] = quality
+            # Normalização EBU R128: medição em cache por conteúdo, 2ª passada fundida à codificação
+            loudness = None
+            if normalizar:
+                try:
+                    loudness = medir_loudness_agendado(
+                        input_path_abs, inicio, limitar_preview(duracao_pedida, preview),
+                        duracao_trecho(duracao, inicio, duracao_pedida, preview), file_size
+                    )
+                except RuntimeError as e:
+                    return jsonify({'error': str(e)[:500]}), 500
             
-            # Para FLAC, usa compressão ao invés de bitrate
-            if formato_saida == 'flac':
-                output_params['compression_level'] = 5
-                # Remove audio_bitrate se foi adicionado
-                output_params.pop('audio_bitrate', None)
+            def montar(qualidade):
+                return montar_conversao(input_path_abs, output_path_abs, formato_saida, qualidade,
+                                        inicio=inicio, duracao=duracao_pedida, preview=preview,
+                                        bitrate_restrito=bitrate_alvo is not None, loudness=loudness)
             
-            stream = ffmpeg.output(stream, output_path_abs, **output_params)
+            # Aguarda a vez do cliente na fila justa (custo = duração do trecho × fator do codec)
+            custo = estimar_custo(duracao_trecho(duracao, inicio, duracao_pedida, preview), config_saida, file_size)
+            cliente = cliente_da_requisicao(request.headers, request.remote_addr)
             
             # Executa a conversão com captura de erros
             try:
-                ffmpeg.run(stream, overwrite_output=True, quiet=True)
+                with agendador.reservar(cliente, custo, config_saida['acodec']):
+                    ffmpeg.run(montar(quality), overwrite_output=True, quiet=True)
+                    
+                    # 2ª passada apenas se a 1ª ficou fora da tolerância do tamanho alvo
+                    if bitrate_alvo and os.path.exists(output_path_abs):
+                        novo_bitrate = revisar_bitrate_alvo(
+                            bitrate_alvo, tamanho_alvo, os.path.getsize(output_path_abs), formato_saida
+                        )
+                        if novo_bitrate:
+                            ffmpeg.run(montar(str(novo_bitrate)), overwrite_output=True, quiet=True)
+                            
+                            # Verificação da 2ª passada: se ainda passou do alvo, desce mais um degrau
+                            tamanho_obtido = os.path.getsize(output_path_abs)
+                            menor_bitrate = tamanho_obtido > tamanho_alvo and reduzir_bitrate_alvo(
+                                novo_bitrate, tamanho_alvo, tamanho_obtido, formato_saida
+                            )
+                            if menor_bitrate:
+                                ffmpeg.run(montar(str(menor_bitrate)), overwrite_output=True, quiet=True)
             except Exception as conv_error:
                 # Captura erro mais detalhado
                 error_details = str(conv_error)
@@ -293,6 +461,9 @@ def convert():
             if output_size == 0:
                 return jsonify({'error': 'Arquivo convertido está vazio. Verifique se o formato de entrada é válido.'}), 500
 
+            if bitrate_alvo and output_size > tamanho_alvo:
+                return jsonify({'error': mensagem_tamanho_excedido(output_size, tamanho_alvo)}), 422
+
             # Lê o arquivo convertido da pasta temporária
             with open(output_path_abs, 'rb') as converted_file:
                 file_bytes = io.BytesIO(converted_file.read())
@@ -307,6 +478,9 @@ def convert():
             )
 
             response.headers['Cache-Control'] = 'no-store'
+            if dados_picos is not None:
+                response.headers['X-Audio-Hash'] = dados_picos['hash']
+                response.headers['X-Peaks-Buckets'] = str(dados_picos['buckets'])
 
             return response
         
@@ -379,6 +553,55 @@ def get_formats():
         'output_formats': sorted(list(FORMATOS_SAIDA.keys()))
     })
 
+@app.route('/api/peaks', methods=['GET', 'POST'])
+def get_peaks():
+    """
+    Retorna os picos da forma de onda
+
+    GET  ?hash=<sha256>&buckets=N&format=json|bin  -> picos já calculados (cache)
+    POST file=<arquivo>, buckets=N, format=json|bin -> calcula (uma vez por conteúdo)
+    """
+    try:
+        buckets = ler_resolucao(request.values.get('buckets'))
+        formato = ler_formato_picos(request.values.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.method == 'GET':
+        hash_conteudo = request.args.get('hash', '').lower()
+        dados = picos_em_cache(hash_conteudo, buckets) if hash_valido(hash_conteudo) else None
+        if dados is None:
+            return jsonify({'error': 'Picos não encontrados para este hash. Envie o arquivo via POST.'}), 404
+        return responder_picos(dados, formato)
+
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    if not allowed_file(file.filename):
+        formatos_str = ', '.join(sorted(FORMATOS_ENTRADA))
+        return jsonify({'error': f'Formato de arquivo não permitido. Formatos suportados: {formatos_str}'}), 400
+
+    input_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1] or '.tmp'}")
+    try:
+        file.save(input_path)
+        dados = calcular_picos_agendado(input_path, buckets)
+    except RuntimeError as e:
+        return jsonify({'error': f'Formato de arquivo não suportado ou corrompido: {str(e)[:200]}'}), 400
+    except (FileNotFoundError, OSError) as e:
+        if not check_ffmpeg():
+            return jsonify({'error': 'FFmpeg não encontrado. Execute: python verificar_ffmpeg.py'}), 500
+        return jsonify({'error': f'Erro ao calcular os picos: {str(e)[:500]}'}), 500
+    finally:
+        try:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+        except OSError:
+            pass
+
+    return responder_picos(dados, formato)
+
+
 @app.route('/')
 def index():
     """Serve a página principal"""
@@ -417,20 +640,25 @@ def request_entity_too_large(error):
     }), 413
 
 
-@app.route('/api/config', methods=['GET'])
-def get_config():
-    """Retorna informações de configuração para o frontend"""
+def montar_config():
+    """Monta as informações de configuração expostas ao frontend"""
     deploy_hint = os.environ.get(
         'DEPLOYMENT_HINT',
         'Em produção (Vercel), uploads grandes são bloqueados. '
         'Para arquivos maiores, execute localmente: python app.py'
     )
-    return jsonify({
+    return {
         'max_upload_size_mb': MAX_UPLOAD_SIZE_MB,
         'edge_upload_limit_mb': EDGE_UPLOAD_LIMIT_MB,
         'ffmpeg_binary': FFMPEG_BINARY,
         'deployment_hint': deploy_hint
-    })
+    }
+
+
+@app.route('/api/config', methods=['GET'])
+def get_config():
+    """Retorna informações de configuração para o frontend"""
+    return jsonify(montar_config())
 
 
 if __name__ == '__main__':
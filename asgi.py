@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor ASGI para conversão de áudio universal
+Mesmas rotas do app.py (/convert, /api/formats, /api/config, /api/peaks), mas com
+uploads e downloads assíncronos e o FFmpeg executado via
+asyncio.create_subprocess_exec. Milhares de conexões lentas ficam em um
+único event loop, enquanto o número de conversões simultâneas (CPU) é
+limitado por MAX_CONVERSOES_SIMULTANEAS e distribuído entre os clientes
+pelo agendador justo (agendador.py).
+
+Uso:
+    python asgi.py
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import os
+import sys
+import uuid
+
+import ffmpeg
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from app import (
+    FORMATOS_ENTRADA,
+    FORMATOS_SAIDA,
+    MAX_UPLOAD_SIZE_MB,
+    FFMPEG_BINARY,
+    UPLOAD_FOLDER,
+    OUTPUT_FOLDER,
+    LIMITE_CONVERSOES,
+    agendador,
+    allowed_file,
+    ler_trecho,
+    ler_formato_picos,
+    hash_valido,
+    valor_booleano,
+    cliente_da_requisicao,
+    check_ffmpeg,
+    montar_config,
+)
+from conversor_audio import (
+    montar_conversao, duracao_do_probe, duracao_trecho, validar_inicio,
+    interpretar_tamanho, calcular_bitrate_alvo, revisar_bitrate_alvo, reduzir_bitrate_alvo,
+    mensagem_tamanho_excedido,
+    limitar_preview, comando_medicao_loudness, interpretar_medicao_loudness,
+    loudness_em_cache, guardar_loudness, CUSTO_LOUDNESS
+)
+from agendador import estimar_custo
+from cache_audio import hash_arquivo
+from picos import (
+    AMOSTRAS_POR_BLOCO, CUSTO_PICOS, RESOLUCAO_CACHE, AcumuladorPicos, comando_decodificacao,
+    guardar_picos, ler_resolucao, picos_binarios, picos_em_cache, reduzir_picos
+)
+
+FFPROBE_BINARY = os.environ.get('FFPROBE_PATH', 'ffprobe')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tamanho máximo de cada campo de texto do formulário (o arquivo é limitado por LimiteCorpo)
+TAMANHO_MAXIMO_CAMPO = 1024 * 1024
+
+MENSAGEM_FFMPEG_AUSENTE = (
+    'FFmpeg não encontrado. Por favor, instale o FFmpeg e adicione ao PATH do sistema.\n\n'
+    '📥 Instalação no Windows:\n\n'
+    '1. Chocolatey (Recomendado):\n   choco install ffmpeg\n\n'
+    '2. Download Manual:\n   - Baixe de: https://www.gyan.dev/ffmpeg/builds/\n'
+    '   - Extraia e adicione a pasta \\bin ao PATH\n\n'
+    '3. Após instalar, feche e reabra o terminal\n'
+    '4. Execute: python verificar_ffmpeg.py'
+)
+
+class LimiteCorpo:
+    """
+    Middleware ASGI que limita o tamanho do corpo das requisições
+
+    Conta os bytes recebidos em vez de confiar no Content-Length, que não
+    existe em uploads chunked; ao passar do limite, a leitura é abortada com
+    413 (tratado por request_entity_too_large) antes de ir para o disco.
+    """
+
+    def __init__(self, app, limite_bytes):
+        self.app = app
+        self.limite_bytes = limite_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        for nome, valor in scope.get('headers', []):
+            if nome == b'content-length' and valor.isdigit() and int(valor) > self.limite_bytes:
+                await _erro_tamanho()(scope, receive, send)
+                return
+
+        recebidos = 0
+
+        async def receber():
+            nonlocal recebidos
+            mensagem = await receive()
+            if mensagem['type'] == 'http.request':
+                recebidos += len(mensagem.get('body', b''))
+                if recebidos > self.limite_bytes:
+                    raise HTTPException(status_code=413)
+            return mensagem
+
+        await self.app(scope, receber, send)
+
+
+async def executar_processo(args, capturar_saida=False):
+    """
+    Executa um processo (ffmpeg/ffprobe) sem bloquear o event loop
+
+    Returns:
+        Tupla (returncode, stdout em bytes ou None, stderr como texto)
+    """
+    processo = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if capturar_saida else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await processo.communicate()
+    except asyncio.CancelledError:
+        # Cliente desconectou: não deixa o FFmpeg órfão consumindo CPU
+        processo.kill()
+        await processo.wait()
+        raise
+    return processo.returncode, stdout, stderr.decode('utf-8', errors='ignore')
+
+
+async def probe_async(caminho):
+    """Equivalente assíncrono de ffmpeg.probe"""
+    returncode, stdout, stderr = await executar_processo(
+        [FFPROBE_BINARY, '-v', 'error', '-show_format', '-show_streams', '-of', 'json', caminho],
+        capturar_saida=True
+    )
+    if returncode != 0:
+        raise ffmpeg.Error('ffprobe', stdout, stderr.encode('utf-8'))
+    return json.loads(stdout.decode('utf-8'))
+
+
+async def calcular_picos_async(caminho, buckets, cliente):
+    """
+    Calcula (ou lê do cache) os picos da forma de onda sem bloquear o event loop
+
+    O PCM é lido do pipe do FFmpeg em blocos de tamanho fixo e reduzido com
+    NumPy a cada bloco (ver picos.AcumuladorPicos).
+
+    Raises:
+        RuntimeError: Se o FFmpeg falhar ao decodificar o arquivo
+    """
+    hash_conteudo = await run_in_threadpool(hash_arquivo, caminho)
+    dados = await run_in_threadpool(picos_em_cache, hash_conteudo, buckets)
+    if dados is not None:
+        return dados
+
+    acumulador = AcumuladorPicos(RESOLUCAO_CACHE)
+    custo = estimar_custo(None, {'custo': CUSTO_PICOS}, os.path.getsize(caminho))
+    async with agendador.reservar_async(cliente, custo):
+        processo = await asyncio.create_subprocess_exec(
+            *comando_decodificacao(caminho, FFMPEG_BINARY),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        leitura_erro = asyncio.ensure_future(processo.stderr.read())
+        try:
+            while True:
+                bloco = await processo.stdout.read(AMOSTRAS_POR_BLOCO * 4)
+                if not bloco:
+                    break
+                acumulador.adicionar_bytes(bloco)
+            erro = (await leitura_erro).decode('utf-8', errors='ignore')
+            await processo.wait()
+        except asyncio.CancelledError:
+            processo.kill()
+            await processo.wait()
+            raise
+
+    if processo.returncode != 0:
+        raise RuntimeError(f'Erro ao decodificar o áudio: {erro[:500]}')
+
+    dados = acumulador.montar_dados(hash_conteudo)
+    await run_in_threadpool(guardar_picos, dados)
+    return reduzir_picos(dados, buckets)
+
+
+async def medir_loudness_async(caminho, inicio, duracao, duracao_medida, file_size, cliente):
+    """
+    Mede o loudness do trecho (1ª passada do loudnorm) sem bloquear o event loop
+
+    Medições anteriores do mesmo conteúdo e trecho vêm do cache.
+
+    Raises:
+        RuntimeError: Se o FFmpeg falhar durante a medição
+    """
+    hash_conteudo = await run_in_threadpool(hash_arquivo, caminho)
+    em_cache = await run_in_threadpool(loudness_em_cache, hash_conteudo, inicio, duracao)
+    if em_cache is not None:
+        return em_cache.get('medicao')
+
+    custo = estimar_custo(duracao_medida, {'custo': CUSTO_LOUDNESS}, file_size)
+    async with agendador.reservar_async(cliente, custo):
+        returncode, _, stderr = await executar_processo(
+            comando_medicao_loudness(caminho, inicio, duracao, FFMPEG_BINARY)
+        )
+    if returncode != 0:
+        raise RuntimeError(f'Erro ao medir o loudness: {stderr[-500:]}')
+    try:
+        medicao = interpretar_medicao_loudness(stderr)
+    except ValueError as e:
+        raise RuntimeError(str(e))
+
+    await run_in_threadpool(guardar_loudness, hash_conteudo, inicio, duracao, medicao)
+    return medicao
+
+
+def _responder_picos(dados, formato):
+    """Monta a resposta com os picos em JSON ou binário (int16 min/max intercalados)"""
+    if formato == 'json':
+        return JSONResponse(dados)
+    return Response(
+        picos_binarios(dados),
+        media_type='application/octet-stream',
+        headers={
+            'X-Audio-Hash': dados['hash'],
+            'X-Peaks-Buckets': str(dados['buckets']),
+            'X-Audio-Duration': str(dados['duration'])
+        }
+    )
+
+
+def _cliente(request):
+    return cliente_da_requisicao(request.headers, request.client.host if request.client else None)
+
+
+async def receber_formulario(request, pasta):
+    """
+    Lê o formulário multipart gravando o arquivo enviado direto em `pasta`
+
+    O upload é escrito no disco uma única vez, à medida que chega, em vez de
+    passar pelo arquivo temporário do request.form() e ser copiado depois.
+
+    Returns:
+        Tupla (campos, arquivo): campos é um dict de textos; arquivo é None ou
+        um dict {'filename', 'path'} com o upload já gravado
+
+    Raises:
+        HTTPException: 400 se o multipart for inválido ou tiver mais de um arquivo
+    """
+    tipo, opcoes = parse_options_header(request.headers.get('content-type'))
+    if tipo != b'multipart/form-data' or b'boundary' not in opcoes:
+        return {}, None
+
+    campos = {}
+    arquivo = None
+    destino = None
+    pendentes = []
+    parte = {}
+
+    def on_part_begin():
+        parte.clear()
+        parte.update(cabecalhos={}, campo=b'', valor=b'', nome=None, dados=None)
+
+    def on_header_field(dados, inicio, fim):
+        parte['campo'] += dados[inicio:fim]
+
+    def on_header_value(dados, inicio, fim):
+        parte['valor'] += dados[inicio:fim]
+
+    def on_header_end():
+        parte['cabecalhos'][parte['campo'].lower()] = parte['valor']
+        parte['campo'] = parte['valor'] = b''
+
+    def on_headers_finished():
+        nonlocal arquivo, destino
+        _, disposicao = parse_options_header(parte['cabecalhos'].get(b'content-disposition'))
+        parte['nome'] = disposicao.get(b'name', b'').decode('utf-8', errors='replace')
+        if b'filename' not in disposicao:
+            parte['dados'] = bytearray()
+            return
+        if arquivo is not None:
+            raise HTTPException(status_code=400, detail='Envie apenas um arquivo por requisição')
+        nome_arquivo = disposicao[b'filename'].decode('utf-8', errors='replace')
+        arquivo = {
+            'filename': nome_arquivo,
+            'path': os.path.abspath(os.path.join(
+                pasta, f"{uuid.uuid4().hex}{os.path.splitext(nome_arquivo)[1] or '.tmp'}"
+            ))
+        }
+        destino = open(arquivo['path'], 'wb')
+
+    def on_part_data(dados, inicio, fim):
+        if parte['dados'] is None:
+            pendentes.append(bytes(dados[inicio:fim]))
+            return
+        parte['dados'] += dados[inicio:fim]
+        if len(parte['dados']) > TAMANHO_MAXIMO_CAMPO:
+            raise HTTPException(status_code=400, detail=f"Campo '{parte['nome']}' muito grande")
+
+    def on_part_end():
+        if parte['dados'] is not None:
+            campos[parte['nome']] = parte['dados'].decode('utf-8', errors='replace')
+
+    parser = MultipartParser(opcoes[b'boundary'], {
+        'on_part_begin': on_part_begin,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+    })
+    try:
+        async for bloco in request.stream():
+            parser.write(bloco)
+            if pendentes:
+                # A escrita no disco vai para o threadpool, fora do event loop
+                await run_in_threadpool(destino.write, b''.join(pendentes))
+                pendentes.clear()
+        parser.finalize()
+    except BaseException as e:
+        if destino is not None:
+            destino.close()
+            _remover_arquivos(arquivo['path'])
+        if isinstance(e, FormParserError):
+            raise HTTPException(status_code=400, detail='Formulário multipart inválido')
+        raise
+    if destino is not None:
+        destino.close()
+    return campos, arquivo
+
+
+def _remover_arquivos(*caminhos):
+    """Remove arquivos temporários, ignorando erros"""
+    for caminho in caminhos:
+        try:
+            if caminho and os.path.exists(caminho):
+                os.remove(caminho)
+        except OSError:
+            pass
+
+
+def _erro(mensagem, status):
+    return JSONResponse({'error': mensagem}, status_code=status)
+
+
+def _erro_tamanho():
+    return _erro(
+        f'Arquivo muito grande para o ambiente atual. '
+        f'Tamanho máximo permitido: {MAX_UPLOAD_SIZE_MB:g}MB.\n\n'
+        'Para converter arquivos maiores, execute o app localmente '
+        '(python app.py) ou utilize a linha de comando.',
+        413
+    )
+
+
+async def convert(request):
+    """Converte arquivo de áudio para outro formato"""
+    if request.method == 'OPTIONS':
+        return JSONResponse({'status': 'ok'})
+
+    form, arquivo = await receber_formulario(request, UPLOAD_FOLDER)
+    if arquivo is None:
+        return _erro('Nenhum arquivo enviado', 400)
+
+    input_path = arquivo['path']
+    output_path = None
+    concluido = False
+    try:
+        quality = form.get('quality', '192k')
+        formato_saida = form.get('format', 'm4a').lower().lstrip('.')
+
+        # Trecho opcional (start/duration) ou prévia rápida (preview=1)
+        try:
+            inicio, duracao_pedida, preview = ler_trecho(form)
+            tamanho_alvo = interpretar_tamanho(form.get('target_size'))
+            normalizar = valor_booleano(form.get('normalize'))
+            peaks = valor_booleano(form.get('peaks'))
+            buckets = ler_resolucao(form.get('buckets')) if peaks else None
+        except ValueError as e:
+            return _erro(str(e), 400)
+
+        if not arquivo['filename']:
+            return _erro('Nenhum arquivo selecionado', 400)
+
+        if not allowed_file(arquivo['filename']):
+            formatos_str = ', '.join(sorted(FORMATOS_ENTRADA))
+            return _erro(f'Formato de arquivo não permitido. Formatos suportados: {formatos_str}', 400)
+
+        if formato_saida not in FORMATOS_SAIDA:
+            formatos_str = ', '.join(sorted(FORMATOS_SAIDA.keys()))
+            return _erro(f'Formato de saída não suportado. Formatos disponíveis: {formatos_str}', 400)
+
+        config_saida = FORMATOS_SAIDA[formato_saida]
+        output_filename = (os.path.splitext(arquivo['filename'])[0] + ('_preview' if preview else '')
+                           + '.' + config_saida['ext'])
+        output_path = os.path.abspath(os.path.join(OUTPUT_FOLDER, f"{uuid.uuid4().hex}.{config_saida['ext']}"))
+
+        file_size = os.path.getsize(input_path)
+        if file_size == 0:
+            return _erro('Arquivo de entrada está vazio', 400)
+
+        # Picos da forma de onda (opcional): ficam em cache e são buscados depois via /api/peaks
+        headers = {'Cache-Control': 'no-store'}
+        if peaks:
+            try:
+                dados_picos = await calcular_picos_async(input_path, buckets, _cliente(request))
+                headers['X-Audio-Hash'] = dados_picos['hash']
+                headers['X-Peaks-Buckets'] = str(dados_picos['buckets'])
+            except (RuntimeError, OSError) as peaks_error:
+                print(f"Aviso: não foi possível calcular os picos: {str(peaks_error)[:300]}")
+
+        # Validação opcional: se ffprobe não estiver disponível, tenta converter mesmo assim
+        duracao = None
+        try:
+            probe = await probe_async(input_path)
+            if not probe.get('streams'):
+                return _erro('Arquivo não contém streams de áudio válidos', 400)
+            duracao = duracao_do_probe(probe)
+        except (ffmpeg.Error, FileNotFoundError, OSError, ValueError) as probe_error:
+            probe_msg = probe_error.stderr.decode('utf-8', errors='ignore') if getattr(probe_error, 'stderr', None) else str(probe_error)
+            print(f"Aviso ao fazer probe do arquivo: {probe_msg[:300]}. Tentando converter mesmo assim.")
+
+        try:
+            validar_inicio(inicio, duracao)
+        except ValueError as e:
+            return _erro(str(e), 400)
+
+        # Modo tamanho alvo: bitrate calculado pela duração do trecho (ignorado na prévia)
+        bitrate_alvo = None
+        if tamanho_alvo and not preview:
+            try:
+                bitrate_alvo = calcular_bitrate_alvo(
+                    tamanho_alvo, duracao_trecho(duracao, inicio, duracao_pedida), formato_saida
+                )
+            except ValueError as e:
+                return _erro(str(e), 400)
+            quality = str(bitrate_alvo)
+
+        # Normalização EBU R128: medição em cache por conteúdo, 2ª passada fundida à codificação
+        loudness = None
+        if normalizar:
+            try:
+                loudness = await medir_loudness_async(
+                    input_path, inicio, limitar_preview(duracao_pedida, preview),
+                    duracao_trecho(duracao, inicio, duracao_pedida, preview), file_size, _cliente(request)
+                )
+            except RuntimeError as e:
+                return _erro(str(e)[:500], 500)
+
+        def comando(qualidade):
+            return ffmpeg.compile(
+                montar_conversao(
+                    input_path, output_path, formato_saida, qualidade,
+                    inicio=inicio, duracao=duracao_pedida, preview=preview,
+                    bitrate_restrito=bitrate_alvo is not None, loudness=loudness
+                ).global_args('-hide_banner', '-loglevel', 'error'),
+                cmd=FFMPEG_BINARY,
+                overwrite_output=True
+            )
+
+        # Aguarda a vez do cliente na fila justa, sem ocupar threads
+        custo = estimar_custo(duracao_trecho(duracao, inicio, duracao_pedida, preview), config_saida, file_size)
+        try:
+            async with agendador.reservar_async(_cliente(request), custo, config_saida['acodec']):
+                returncode, _, error_message = await executar_processo(comando(quality))
+
+                # 2ª passada apenas se a 1ª ficou fora da tolerância do tamanho alvo
+                if returncode == 0 and bitrate_alvo and os.path.exists(output_path):
+                    novo_bitrate = revisar_bitrate_alvo(
+                        bitrate_alvo, tamanho_alvo, os.path.getsize(output_path), formato_saida
+                    )
+                    if novo_bitrate:
+                        returncode, _, error_message = await executar_processo(comando(str(novo_bitrate)))
+
+                        # Verificação da 2ª passada: se ainda passou do alvo, desce mais um degrau
+                        tamanho_obtido = os.path.getsize(output_path) if returncode == 0 else 0
+                        menor_bitrate = tamanho_obtido > tamanho_alvo and reduzir_bitrate_alvo(
+                            novo_bitrate, tamanho_alvo, tamanho_obtido, formato_saida
+                        )
+                        if menor_bitrate:
+                            returncode, _, error_message = await executar_processo(comando(str(menor_bitrate)))
+        except (FileNotFoundError, OSError):
+            if not await run_in_threadpool(check_ffmpeg):
+                return _erro(MENSAGEM_FFMPEG_AUSENTE, 500)
+            raise
+
+        if returncode != 0:
+            error_lower = error_message.lower()
+            if 'invalid data found' in error_lower or 'could not find codec' in error_lower:
+                return _erro(f'Formato de arquivo não suportado ou corrompido: {error_message[:200]}', 400)
+            return _erro(f'Erro na conversão FFmpeg: {error_message[:500]}', 500)
+
+        if not os.path.exists(output_path):
+            return _erro('Arquivo de saída não foi criado. Verifique se o FFmpeg está funcionando corretamente.', 500)
+
+        if os.path.getsize(output_path) == 0:
+            return _erro('Arquivo convertido está vazio. Verifique se o formato de entrada é válido.', 500)
+
+        if bitrate_alvo and os.path.getsize(output_path) > tamanho_alvo:
+            return _erro(mensagem_tamanho_excedido(os.path.getsize(output_path), tamanho_alvo), 422)
+
+        # Envia o arquivo em blocos, de forma assíncrona, e remove os temporários ao final
+        concluido = True
+        return FileResponse(
+            output_path,
+            media_type=config_saida['mimetype'],
+            filename=output_filename,
+            headers=headers,
+            background=BackgroundTask(_remover_arquivos, input_path, output_path)
+        )
+
+    except Exception as e:
+        return _erro(f'Erro inesperado: {str(e)[:500]}', 500)
+
+    finally:
+        if not concluido:
+            _remover_arquivos(input_path, output_path)
+
+
+async def get_peaks(request):
+    """
+    Retorna os picos da forma de onda
+
+    GET  ?hash=<sha256>&buckets=N&format=json|bin  -> picos já calculados (cache)
+    POST file=<arquivo>, buckets=N, format=json|bin -> calcula (uma vez por conteúdo)
+    """
+    form, arquivo = await receber_formulario(request, UPLOAD_FOLDER) if request.method == 'POST' else ({}, None)
+    input_path = arquivo['path'] if arquivo else None
+    try:
+        valores = {**request.query_params, **form}
+        try:
+            buckets = ler_resolucao(valores.get('buckets'))
+            formato = ler_formato_picos(valores.get('format'))
+        except ValueError as e:
+            return _erro(str(e), 400)
+
+        if request.method == 'GET':
+            hash_conteudo = request.query_params.get('hash', '').lower()
+            dados = picos_em_cache(hash_conteudo, buckets) if hash_valido(hash_conteudo) else None
+            if dados is None:
+                return _erro('Picos não encontrados para este hash. Envie o arquivo via POST.', 404)
+            return _responder_picos(dados, formato)
+
+        if arquivo is None or not arquivo['filename']:
+            return _erro('Nenhum arquivo enviado', 400)
+
+        if not allowed_file(arquivo['filename']):
+            formatos_str = ', '.join(sorted(FORMATOS_ENTRADA))
+            return _erro(f'Formato de arquivo não permitido. Formatos suportados: {formatos_str}', 400)
+
+        dados = await calcular_picos_async(input_path, buckets, _cliente(request))
+    except RuntimeError as e:
+        return _erro(f'Formato de arquivo não suportado ou corrompido: {str(e)[:200]}', 400)
+    except (FileNotFoundError, OSError) as e:
+        if not await run_in_threadpool(check_ffmpeg):
+            return _erro(MENSAGEM_FFMPEG_AUSENTE, 500)
+        return _erro(f'Erro ao calcular os picos: {str(e)[:500]}', 500)
+    finally:
+        _remover_arquivos(input_path)
+
+    return _responder_picos(dados, formato)
+
+
+async def get_formats(request):
+    """Retorna lista de formatos suportados"""
+    return JSONResponse({
+        'input_formats': sorted(list(FORMATOS_ENTRADA)),
+        'output_formats': sorted(list(FORMATOS_SAIDA.keys()))
+    })
+
+
+async def get_config(request):
+    """Retorna informações de configuração para o frontend"""
+    return JSONResponse(montar_config())
+
+
+def _arquivo_estatico(nome):
+    async def servir(request):
+        return FileResponse(os.path.join(BASE_DIR, nome))
+    return servir
+
+
+async def method_not_allowed(request, exc):
+    """Trata método HTTP não permitido"""
+    return _erro(f'Método não permitido. A rota /convert aceita apenas POST. Método usado: {request.method}', 405)
+
+
+async def request_entity_too_large(request, exc):
+    """Trata arquivos muito grandes"""
+    return _erro_tamanho()
+
+
+async def http_exception(request, exc):
+    return _erro(exc.detail, exc.status_code)
+
+
+app = Starlette(
+    routes=[
+        Route('/convert', convert, methods=['POST', 'OPTIONS']),
+        Route('/api/formats', get_formats, methods=['GET']),
+        Route('/api/peaks', get_peaks, methods=['GET', 'POST']),
+        Route('/api/config', get_config, methods=['GET']),
+        Route('/', _arquivo_estatico('index.html')),
+        Route('/style.css', _arquivo_estatico('style.css')),
+        Route('/script.js', _arquivo_estatico('script.js')),
+    ],
+    # CORS fica por fora, para que também o 413 do LimiteCorpo tenha os cabeçalhos CORS
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_methods=['*'],
+            allow_headers=['*'],
+            expose_headers=['X-Audio-Hash', 'X-Peaks-Buckets', 'X-Audio-Duration']
+        ),
+        Middleware(LimiteCorpo, limite_bytes=int(MAX_UPLOAD_SIZE_MB * 1024 * 1024)),
+    ],
+    exception_handlers={
+        405: method_not_allowed,
+        413: request_entity_too_large,
+        HTTPException: http_exception,
+    }
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    if not check_ffmpeg():
+        print("⚠️  ERRO: FFmpeg não encontrado! Execute: python verificar_ffmpeg.py")
+        sys.exit(1)
+
+    print("=" * 50)
+    print("🎵 Servidor de Conversão de Áudio (ASGI)")
+    print("=" * 50)
+    print(f"Conversões simultâneas: {LIMITE_CONVERSOES}")
+    print("Servidor rodando em: http://localhost:5000")
+    print("=" * 50)
+
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Autotune de concorrência e threads do FFmpeg
+
+Mede, nesta máquina, a vazão de cada encoder de FORMATOS_SAIDA com áudio
+sintético (lavfi) em diferentes combinações de conversões simultâneas e
+-threads, e grava um perfil JSON. O servidor (app.py/asgi.py) e a CLI
+(conversor_audio.py) carregam esse perfil na inicialização para escolher o
+paralelismo de cada codec.
+
+Uso:
+    python autotune.py
+    python autotune.py --duracao 30 --codecs libmp3lame,flac
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+from conversor_audio import FORMATOS_SAIDA, CAMINHO_PERFIL
+
+FFMPEG_BINARY = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+# Combinações dentro desta margem da melhor vazão preferem menos processos/threads
+MARGEM_EMPATE = 0.05
+
+# Parâmetros de entrada exigidos por codecs que não aceitam 44.1kHz estéreo
+AMOSTRAGEM_CODEC = {
+    'libopus': (48000, 2),
+    'libopencore_amrnb': (8000, 1),
+}
+
+BITRATE_CODEC = {
+    'libopencore_amrnb': '12.2k',
+}
+
+
+def _comando(acodec, duracao, threads):
+    """Comando que codifica `duracao` segundos de ruído sintético e descarta a saída"""
+    taxa, canais = AMOSTRAGEM_CODEC.get(acodec, (44100, 2))
+    comando = [
+        FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-f', 'lavfi', '-i', f'anoisesrc=d={duracao}:r={taxa}:a=0.3',
+        '-ac', str(canais), '-ar', str(taxa),
+        '-acodec', acodec, '-threads', str(threads)
+    ]
+    if acodec == 'flac':
+        comando += ['-compression_level', '5']
+    elif not acodec.startswith('pcm_'):
+        comando += ['-b:a', BITRATE_CODEC.get(acodec, '192k')]
+    return comando + ['-f', 'null', '-']
+
+
+def medir_vazao(acodec, concorrencia, threads, duracao):
+    """
+    Executa `concorrencia` codificações simultâneas
+
+    Returns:
+        Segundos de áudio codificados por segundo de relógio
+
+    Raises:
+        RuntimeError: Se o FFmpeg falhar (ex.: encoder indisponível)
+    """
+    comando = _comando(acodec, duracao, threads)
+    inicio = time.perf_counter()
+    processos = [
+        subprocess.Popen(comando, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for _ in range(concorrencia)
+    ]
+    erros = [p.communicate()[1] for p in processos]
+    decorrido = time.perf_counter() - inicio
+
+    for processo, erro in zip(processos, erros):
+        if processo.returncode != 0:
+            raise RuntimeError(erro.decode('utf-8', errors='ignore').strip()[:300])
+    return concorrencia * duracao / decorrido
+
+
+def _candidatos(cpus):
+    """Gera as combinações (concorrência, threads) a testar"""
+    concorrencias = sorted({1, cpus} | {2 ** i for i in range(1, cpus.bit_length()) if 2 ** i <= cpus})
+    threads = sorted({1, 2, 0})  # 0 = automático (FFmpeg decide)
+    for concorrencia in concorrencias:
+        for thread in threads:
+            # Evita combinações que certamente sobrecarregam a CPU
+            if concorrencia > 1 and concorrencia * (thread or cpus) > 2 * cpus:
+                continue
+            yield concorrencia, thread
+
+
+def ajustar_codec(acodec, cpus, duracao, repeticoes=2):
+    """
+    Testa as combinações para um codec e escolhe a melhor
+
+    Cada combinação é medida `repeticoes` vezes e vale a melhor vazão, o que
+    reduz o ruído de outros processos na máquina.
+
+    Returns:
+        Dicionário {'concorrencia', 'threads', 'vazao'}
+    """
+    medicoes = []
+    for concorrencia, threads in _candidatos(cpus):
+        vazao = max(medir_vazao(acodec, concorrencia, threads, duracao) for _ in range(repeticoes))
+        medicoes.append((vazao, concorrencia, threads))
+        print(f"  concorrência={concorrencia:<3} threads={threads or 'auto':<5} {vazao:8.1f}x tempo real")
+
+    melhor = max(v for v, _, _ in medicoes)
+    # Entre as combinações praticamente empatadas, usa a que ocupa menos recursos
+    vazao, concorrencia, threads = min(
+        (m for m in medicoes if m[0] >= melhor * (1 - MARGEM_EMPATE)),
+        key=lambda m: (m[1] * (m[2] or cpus), m[1])
+    )
+    return {'concorrencia': concorrencia, 'threads': threads, 'vazao': round(vazao, 1)}
+
+
+def _argumento_duracao(valor):
+    """Tipo do argparse para --duracao (segundos, maior que zero)"""
+    try:
+        duracao = float(valor)
+    except ValueError:
+        duracao = float('nan')
+    if not (duracao > 0 and math.isfinite(duracao)):
+        raise argparse.ArgumentTypeError(f"Duração inválida: '{valor}'. Use um número de segundos maior que zero")
+    return duracao
+
+
+def main():
+    codecs_disponiveis = sorted({config['acodec'] for config in FORMATOS_SAIDA.values()})
+
+    parser = argparse.ArgumentParser(
+        description='Mede o paralelismo ideal de cada encoder nesta máquina e grava o perfil de ajuste'
+    )
+    parser.add_argument(
+        '--duracao',
+        type=_argumento_duracao,
+        default=20,
+        help='Segundos de áudio sintético por codificação (padrão: 20)'
+    )
+    parser.add_argument(
+        '--repeticoes',
+        type=int,
+        default=2,
+        help='Medições por combinação; vale a melhor (padrão: 2)'
+    )
+    parser.add_argument(
+        '--codecs',
+        help=f'Codecs a medir, separados por vírgula (padrão: todos). Disponíveis: {", ".join(codecs_disponiveis)}'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest='saida',
+        default=CAMINHO_PERFIL,
+        help=f'Arquivo do perfil (padrão: {CAMINHO_PERFIL})'
+    )
+    args = parser.parse_args()
+
+    codecs = args.codecs.split(',') if args.codecs else codecs_disponiveis
+    cpus = os.cpu_count() or 1
+
+    print(f"Autotune: {cpus} CPU(s), {args.duracao:g}s de áudio por codificação")
+    print("-" * 50)
+
+    resultado = {}
+    for acodec in codecs:
+        print(f"{acodec}:")
+        try:
+            resultado[acodec] = ajustar_codec(acodec, cpus, args.duracao, max(1, args.repeticoes))
+        except (RuntimeError, OSError) as e:
+            print(f"  Aviso: {acodec} ignorado ({e})")
+            continue
+        ajuste = resultado[acodec]
+        print(f"  → concorrência={ajuste['concorrencia']} threads={ajuste['threads'] or 'auto'}")
+
+    if not resultado:
+        print("Erro: nenhum codec pôde ser medido. Verifique o FFmpeg (python verificar_ffmpeg.py)")
+        sys.exit(1)
+
+    perfil = {
+        'gerado_em': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'cpus': cpus,
+        'codecs': resultado
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(perfil, f, indent=2)
+
+    print("-" * 50)
+    print(f"✓ Perfil gravado em: {args.saida}")
+    print("Reinicie o servidor para aplicar o novo perfil.")
+
+
+if __name__ == '__main__':
+    main()
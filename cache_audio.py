@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache em disco de resultados derivados do conteúdo de arquivos de áudio
+
+As entradas são indexadas pelo hash SHA-256 do conteúdo, então o mesmo
+áudio enviado com outro nome (ou por outro cliente) reaproveita o resultado.
+O diretório é limitado em idade e tamanho: entradas antigas e, acima do
+limite, as menos usadas recentemente são removidas.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.environ.get(
+    'AUDIO_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'audio-converter', 'cache')
+)
+
+# Tamanho total máximo do cache e idade máxima das entradas
+CACHE_MAX_BYTES = int(float(os.environ.get('AUDIO_CACHE_MAX_MB', '512')) * 1024 * 1024)
+CACHE_MAX_SEGUNDOS = float(os.environ.get('AUDIO_CACHE_MAX_DIAS', '30')) * 24 * 3600
+
+# Intervalo mínimo entre duas varreduras de limpeza
+INTERVALO_LIMPEZA = 60
+
+# Tamanho dos blocos lidos ao calcular o hash
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+# Bytes lidos do início e do fim no hash parcial
+TAMANHO_BLOCO_PARCIAL = 64 * 1024
+
+_CHAVE_INVALIDA = re.compile(r'[^A-Za-z0-9_.-]')
+
+_lock_limpeza = threading.Lock()
+_ultima_limpeza = 0.0
+
+
+def hash_arquivo(caminho):
+    """Calcula o SHA-256 (hex) do conteúdo do arquivo, lendo em blocos"""
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def hash_parcial(caminho):
+    """
+    Hash rápido do tamanho + primeiro e último bloco do arquivo
+
+    Serve apenas como pré-filtro: arquivos com hashes parciais diferentes têm
+    conteúdos diferentes, mas hashes iguais ainda precisam de hash_arquivo.
+    """
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        tamanho = os.fstat(f.fileno()).st_size
+        sha.update(str(tamanho).encode())
+        sha.update(f.read(TAMANHO_BLOCO_PARCIAL))
+        if tamanho > 2 * TAMANHO_BLOCO_PARCIAL:
+            f.seek(-TAMANHO_BLOCO_PARCIAL, os.SEEK_END)
+            sha.update(f.read(TAMANHO_BLOCO_PARCIAL))
+        elif tamanho > TAMANHO_BLOCO_PARCIAL:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _caminho_cache(categoria, chave):
+    return os.path.join(CACHE_DIR, categoria, _CHAVE_INVALIDA.sub('_', chave) + '.json')
+
+
+def ler_cache(categoria, chave):
+    """Retorna o dicionário armazenado, ou None se não houver entrada válida"""
+    caminho = _caminho_cache(categoria, chave)
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Marca a entrada como usada recentemente (a limpeza remove as mais antigas primeiro)
+    try:
+        os.utime(caminho)
+    except OSError:
+        pass
+    return dados
+
+
+def gravar_cache(categoria, chave, dados):
+    """Grava o dicionário de forma atômica (leitores nunca veem arquivo parcial)"""
+    destino = _caminho_cache(categoria, chave)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, separators=(',', ':'))
+        os.replace(temporario, destino)
+    except OSError:
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+        raise
+    limpar_cache()
+
+
+def limpar_cache(forcar=False):
+    """
+    Aplica os limites de idade e tamanho ao diretório do cache
+
+    Remove as entradas mais antigas que CACHE_MAX_SEGUNDOS e, se o total ainda
+    passar de CACHE_MAX_BYTES, as usadas há mais tempo. Fora de `forcar`, roda
+    no máximo uma vez a cada INTERVALO_LIMPEZA segundos.
+    """
+    global _ultima_limpeza
+    agora = time.time()
+    with _lock_limpeza:
+        if not forcar and agora - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return
+        _ultima_limpeza = agora
+
+    entradas = []
+    for pasta, _, arquivos in os.walk(CACHE_DIR):
+        for nome in arquivos:
+            if not nome.endswith('.json'):
+                continue
+            caminho = os.path.join(pasta, nome)
+            try:
+                info = os.stat(caminho)
+            except OSError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, caminho))
+
+    entradas.sort()
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for modificado, tamanho, caminho in entradas:
+        if total <= CACHE_MAX_BYTES and agora - modificado <= CACHE_MAX_SEGUNDOS:
+            break
+        try:
+            os.remove(caminho)
+        except OSError:
+            continue
+        total -= tamanho
@@ -6,10 +6,18 @@ Converte arquivos de áudio entre todos os formatos suportados
 """
 
 import os
+import re
 import sys
+import json
+import math
+import shutil
+import subprocess
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from cache_audio import hash_arquivo, hash_parcial, ler_cache, gravar_cache
+
 try:
     import ffmpeg
 except ImportError:
@@ -27,30 +35,506 @@ FORMATOS_ENTRADA = {
     'raw', 'rf64', 'sln', 'vox', 'webm'
 }
 
+# 'custo': CPU por segundo de áudio relativa ao libmp3lame (medido com -benchmark), usado pelo agendador.
+# Limites de bitrate (kbps, estéreo) e sobrecarga do contêiner usados no modo tamanho alvo.
+# 'bitrates_validos': codecs CBR que só aceitam valores fixos (o FFmpeg arredonda os demais).
+# Formatos sem limites (PCM/lossless) não têm controle de bitrate.
 FORMATOS_SAIDA = {
-    'mp3': {'acodec': 'libmp3lame', 'ext': 'mp3'},
-    'wav': {'acodec': 'pcm_s16le', 'ext': 'wav'},
-    'flac': {'acodec': 'flac', 'ext': 'flac'},
-    'ogg': {'acodec': 'libvorbis', 'ext': 'ogg'},
-    'aac': {'acodec': 'aac', 'ext': 'aac'},
-    'm4a': {'acodec': 'aac', 'ext': 'm4a'},
-    'opus': {'acodec': 'libopus', 'ext': 'opus'},
-    'wma': {'acodec': 'wmav2', 'ext': 'wma'},
-    'aiff': {'acodec': 'pcm_s16be', 'ext': 'aiff'},
-    'aif': {'acodec': 'pcm_s16be', 'ext': 'aif'},
-    'ac3': {'acodec': 'ac3', 'ext': 'ac3'},
-    'mp2': {'acodec': 'mp2', 'ext': 'mp2'},
-    'amr': {'acodec': 'libopencore_amrnb', 'ext': 'amr'},
-    'webm': {'acodec': 'libopus', 'ext': 'webm'}
+    'mp3': {'acodec': 'libmp3lame', 'ext': 'mp3', 'custo': 1.0, 'bitrate_min': 32, 'bitrate_max': 320, 'sobrecarga': 0.005,
+            'bitrates_validos': (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)},
+    'wav': {'acodec': 'pcm_s16le', 'ext': 'wav', 'custo': 0.1},
+    'flac': {'acodec': 'flac', 'ext': 'flac', 'custo': 0.2},
+    'ogg': {'acodec': 'libvorbis', 'ext': 'ogg', 'custo': 1.3, 'bitrate_min': 48, 'bitrate_max': 500, 'sobrecarga': 0.015},
+    'aac': {'acodec': 'aac', 'ext': 'aac', 'custo': 2.2, 'bitrate_min': 32, 'bitrate_max': 512, 'sobrecarga': 0.02},
+    'm4a': {'acodec': 'aac', 'ext': 'm4a', 'custo': 2.2, 'bitrate_min': 32, 'bitrate_max': 512, 'sobrecarga': 0.02},
+    'opus': {'acodec': 'libopus', 'ext': 'opus', 'custo': 3.2, 'bitrate_min': 6, 'bitrate_max': 510, 'sobrecarga': 0.015},
+    'wma': {'acodec': 'wmav2', 'ext': 'wma', 'custo': 0.5, 'bitrate_min': 32, 'bitrate_max': 320, 'sobrecarga': 0.12},
+    'aiff': {'acodec': 'pcm_s16be', 'ext': 'aiff', 'custo': 0.1},
+    'aif': {'acodec': 'pcm_s16be', 'ext': 'aif', 'custo': 0.1},
+    'ac3': {'acodec': 'ac3', 'ext': 'ac3', 'custo': 0.35, 'bitrate_min': 32, 'bitrate_max': 640, 'sobrecarga': 0.0,
+            'bitrates_validos': (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384, 448, 512, 576, 640)},
+    'mp2': {'acodec': 'mp2', 'ext': 'mp2', 'custo': 0.35, 'bitrate_min': 32, 'bitrate_max': 384, 'sobrecarga': 0.0,
+            'bitrates_validos': (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384)},
+    'amr': {'acodec': 'libopencore_amrnb', 'ext': 'amr', 'custo': 0.5, 'bitrate_min': 4.75, 'bitrate_max': 12.2, 'sobrecarga': 0.0,
+            'bitrates_validos': (4.75, 5.15, 5.9, 6.7, 7.4, 7.95, 10.2, 12.2)},
+    'webm': {'acodec': 'libopus', 'ext': 'webm', 'custo': 3.2, 'bitrate_min': 6, 'bitrate_max': 510, 'sobrecarga': 0.035}
 }
 
+# Perfil gerado por autotune.py: paralelismo e -threads por codec medidos nesta máquina
+CAMINHO_PERFIL = os.environ.get(
+    'PERFIL_AJUSTE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perfil_ajuste.json')
+)
+
+# Modo prévia: trecho curto e em bitrate baixo, para ouvir antes de converter tudo
+PREVIEW_DURACAO = 30
+PREVIEW_QUALIDADE = '64k'
+
+# Normalização de loudness EBU R128 (filtro loudnorm em duas passadas)
+LOUDNORM_ALVO = {'I': -23.0, 'TP': -1.0, 'LRA': 7.0}
+# Custo relativo da passada de medição para o agendador (mesma escala de FORMATOS_SAIDA['custo'])
+CUSTO_LOUDNESS = 1.6
+
+# Modo tamanho alvo: cabeçalhos/metadados fixos do contêiner e tolerância antes da 2ª passada
+SOBRECARGA_FIXA_BYTES = 4096
+TOLERANCIA_TAMANHO = 0.05
+
+def carregar_perfil(caminho=None):
+    """
+    Carrega o perfil de ajuste gerado por autotune.py
+    
+    Returns:
+        Dicionário {acodec: {'concorrencia': int, 'threads': int}}, vazio se não houver perfil
+        (ou, com um aviso, se o arquivo for inválido)
+    """
+    caminho = caminho or CAMINHO_PERFIL
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            perfil = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Aviso: perfil de ajuste inválido ({caminho}): {e}")
+        return {}
+    
+    # JSON válido mas com outra estrutura (ex.: lista) também é ignorado
+    if not isinstance(perfil, dict) or not isinstance(perfil.get('codecs', {}), dict):
+        print(f"Aviso: perfil de ajuste inválido ({caminho}): estrutura inesperada")
+        return {}
+    
+    codecs = {}
+    for acodec, ajuste in perfil.get('codecs', {}).items():
+        try:
+            codecs[acodec] = {
+                'concorrencia': max(1, int(ajuste['concorrencia'])),
+                'threads': max(0, int(ajuste['threads']))
+            }
+        except (KeyError, TypeError, ValueError):
+            continue
+    return codecs
+
+
+# Carregado uma vez, na inicialização da CLI e dos servidores
+PERFIL_AJUSTE = carregar_perfil()
+
+
 def detectar_formato(arquivo):
     """Detecta o formato do arquivo pela extensão"""
     ext = Path(arquivo).suffix.lower().lstrip('.')
     return ext if ext in FORMATOS_ENTRADA else None
 
 
-def converter_audio(arquivo_entrada, arquivo_saida=None, formato_saida='m4a', qualidade='192k'):
+def interpretar_tempo(valor):
+    """
+    Converte um tempo em segundos ('90', '90.5') ou no formato [HH:]MM:SS[.ms]
+    ('1:30', '01:02:03.5') para segundos
+    
+    Returns:
+        Tempo em segundos (float), ou None se o valor estiver vazio
+    
+    Raises:
+        ValueError: Se o valor não for um tempo válido
+    """
+    if valor is None or str(valor).strip() == '':
+        return None
+    
+    partes = str(valor).strip().split(':')
+    if len(partes) > 3:
+        raise ValueError(f"Tempo inválido: '{valor}'")
+    
+    try:
+        numeros = [float(parte) for parte in partes]
+    except ValueError:
+        raise ValueError(f"Tempo inválido: '{valor}'. Use segundos (ex: 90) ou HH:MM:SS (ex: 00:01:30)")
+    
+    # Cada parte é validada (senão '1:-30' viraria 30 segundos)
+    if any(numero < 0 or not math.isfinite(numero) for numero in numeros):
+        raise ValueError(f"Tempo inválido: '{valor}'")
+    
+    segundos = 0.0
+    for numero in numeros:
+        segundos = segundos * 60 + numero
+    return segundos
+
+
+def interpretar_duracao(valor):
+    """
+    Como interpretar_tempo, mas para a duração do trecho (que não pode ser zero)
+    
+    Raises:
+        ValueError: Se o valor não for um tempo válido ou for zero
+    """
+    duracao = interpretar_tempo(valor)
+    if duracao == 0:
+        raise ValueError('A duração do trecho deve ser maior que zero')
+    return duracao
+
+
+def validar_inicio(inicio, duracao_total):
+    """
+    Verifica se o início do trecho está dentro do áudio (quando a duração é conhecida)
+    
+    Raises:
+        ValueError: Se o início for igual ou posterior ao fim do áudio
+    """
+    if inicio and duracao_total is not None and inicio >= duracao_total:
+        raise ValueError(f'O início do trecho ({inicio:g}s) está além da duração do áudio ({duracao_total:g}s)')
+
+
+def limitar_preview(duracao, preview):
+    """Aplica o limite de PREVIEW_DURACAO à duração pedida quando em modo prévia"""
+    if not preview:
+        return duracao
+    return min(duracao, PREVIEW_DURACAO) if duracao else PREVIEW_DURACAO
+
+
+def duracao_trecho(duracao_total, inicio=None, duracao=None, preview=False):
+    """
+    Calcula a duração efetiva do trecho que será convertido
+    
+    Returns:
+        Duração em segundos, ou None se não puder ser determinada
+    """
+    duracao = limitar_preview(duracao, preview)
+    if duracao_total is not None:
+        restante = max(0.0, duracao_total - (inicio or 0))
+        return min(restante, duracao) if duracao else restante
+    return duracao
+
+
+def interpretar_tamanho(valor):
+    """
+    Converte um tamanho como '8M', '8MB', '500k' ou '1048576' para bytes
+    (unidades binárias: k = 1024, M = 1024², G = 1024³)
+    
+    Returns:
+        Tamanho em bytes (int), ou None se o valor estiver vazio
+    
+    Raises:
+        ValueError: Se o valor não for um tamanho válido
+    """
+    if valor is None or str(valor).strip() == '':
+        return None
+    
+    texto = str(valor).strip().lower().replace(' ', '')
+    if texto.endswith('ib'):
+        texto = texto[:-2]
+    elif texto.endswith('b'):
+        texto = texto[:-1]
+    multiplicador = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}.get(texto[-1:], 1)
+    if multiplicador != 1:
+        texto = texto[:-1]
+    
+    try:
+        numero = float(texto)
+    except ValueError:
+        numero = float('nan')
+    if not math.isfinite(numero):
+        raise ValueError(f"Tamanho inválido: '{valor}'. Exemplos: 8M, 500k, 1048576")
+    tamanho = int(numero * multiplicador)
+    if tamanho <= SOBRECARGA_FIXA_BYTES:
+        raise ValueError(f"Tamanho alvo muito pequeno: '{valor}'")
+    return tamanho
+
+
+def _limites_bitrate(formato_saida):
+    config = FORMATOS_SAIDA[formato_saida]
+    if 'bitrate_max' not in config:
+        raise ValueError(f"O formato '{formato_saida}' não tem controle de bitrate e não aceita tamanho alvo")
+    return config['bitrate_min'] * 1000, config['bitrate_max'] * 1000
+
+
+def _ajustar_bitrate_valido(bitrate, formato_saida):
+    """Arredonda para baixo até um bitrate aceito pelo codec (quando ele só aceita valores fixos)"""
+    validos = FORMATOS_SAIDA[formato_saida].get('bitrates_validos')
+    if not validos:
+        return int(bitrate)
+    abaixo = [v * 1000 for v in validos if v * 1000 <= bitrate]
+    return int(max(abaixo) if abaixo else validos[0] * 1000)
+
+
+def calcular_bitrate_alvo(tamanho_alvo, duracao, formato_saida):
+    """
+    Calcula o bitrate de áudio (bits/s) para que a saída caiba em tamanho_alvo bytes
+    
+    Desconta a sobrecarga do contêiner e limita ao intervalo suportado pelo codec.
+    
+    Raises:
+        ValueError: Se a duração for desconhecida, o formato não tiver controle de
+                    bitrate ou o tamanho for pequeno demais para a duração
+    """
+    if not duracao:
+        raise ValueError('Não foi possível obter a duração do áudio para calcular o tamanho alvo (verifique o ffprobe)')
+    
+    minimo, maximo = _limites_bitrate(formato_saida)
+    sobrecarga = FORMATOS_SAIDA[formato_saida]['sobrecarga']
+    bitrate = (tamanho_alvo - SOBRECARGA_FIXA_BYTES) * (1 - sobrecarga) * 8 / duracao
+    
+    if bitrate < minimo:
+        tamanho_minimo = minimo * duracao / 8 / (1 - sobrecarga) + SOBRECARGA_FIXA_BYTES
+        raise ValueError(
+            f'Tamanho alvo pequeno demais para {duracao:.0f}s em {formato_saida}. '
+            f'Mínimo aproximado: {tamanho_minimo / 1024 / 1024:.2f}MB'
+        )
+    return _ajustar_bitrate_valido(min(bitrate, maximo), formato_saida)
+
+
+def revisar_bitrate_alvo(bitrate, tamanho_alvo, tamanho_obtido, formato_saida):
+    """
+    Verifica o resultado da 1ª passada do modo tamanho alvo
+    
+    Returns:
+        Novo bitrate (bits/s) para uma 2ª passada, ou None se o arquivo já está
+        dentro da tolerância (ou se não há como ajustar)
+    """
+    minimo, maximo = _limites_bitrate(formato_saida)
+    passou = tamanho_obtido > tamanho_alvo
+    sobrou = tamanho_obtido < tamanho_alvo * (1 - TOLERANCIA_TAMANHO) and bitrate < maximo
+    if not (passou or sobrou):
+        return None
+    
+    # Corrige proporcionalmente à parte do arquivo que depende do bitrate, mirando
+    # um pouco abaixo do alvo para não estourar por causa da variação do encoder
+    util_obtido = max(1, tamanho_obtido - SOBRECARGA_FIXA_BYTES)
+    util_alvo = (tamanho_alvo - SOBRECARGA_FIXA_BYTES) * (1 - TOLERANCIA_TAMANHO / 2)
+    novo = _ajustar_bitrate_valido(min(max(bitrate * util_alvo / util_obtido, minimo), maximo), formato_saida)
+    return novo if novo != bitrate else None
+
+
+def reduzir_bitrate_alvo(bitrate, tamanho_alvo, tamanho_obtido, formato_saida):
+    """
+    Passo final do modo tamanho alvo, quando a saída ainda passou do alvo
+    
+    Returns:
+        Bitrate menor que `bitrate` (redução proporcional com margem extra, ou o
+        próximo valor aceito pelo codec), ou None se o codec já está no mínimo
+    """
+    minimo, _ = _limites_bitrate(formato_saida)
+    util_obtido = max(1, tamanho_obtido - SOBRECARGA_FIXA_BYTES)
+    util_alvo = (tamanho_alvo - SOBRECARGA_FIXA_BYTES) * (1 - TOLERANCIA_TAMANHO)
+    proporcional = min(bitrate * util_alvo / util_obtido, bitrate * (1 - TOLERANCIA_TAMANHO))
+    novo = _ajustar_bitrate_valido(max(proporcional, minimo), formato_saida)
+    if novo >= bitrate:
+        abaixo = [v * 1000 for v in FORMATOS_SAIDA[formato_saida].get('bitrates_validos', []) if v * 1000 < bitrate]
+        novo = max(abaixo) if abaixo else None
+    return novo
+
+
+def mensagem_tamanho_excedido(tamanho_obtido, tamanho_alvo):
+    return (f'Não foi possível gerar a saída dentro do tamanho alvo: {tamanho_obtido} bytes '
+            f'(alvo: {tamanho_alvo}). Use um tamanho maior ou um trecho menor.')
+
+
+def comando_medicao_loudness(arquivo_entrada, inicio=None, duracao=None, ffmpeg_bin='ffmpeg'):
+    """Comando da 1ª passada do loudnorm (apenas mede; a saída é descartada)"""
+    comando = [ffmpeg_bin, '-hide_banner', '-nostdin', '-nostats']
+    if inicio:
+        comando += ['-ss', str(inicio)]
+    if duracao:
+        comando += ['-t', str(duracao)]
+    filtro = 'loudnorm=I={I}:TP={TP}:LRA={LRA}:print_format=json'.format(**LOUDNORM_ALVO)
+    return comando + ['-i', str(arquivo_entrada), '-vn', '-af', filtro, '-f', 'null', '-']
+
+
+def interpretar_medicao_loudness(stderr):
+    """
+    Extrai loudness integrado, LRA, true-peak, limiar e offset da saída do loudnorm
+    
+    Returns:
+        Dicionário com as medições, ou None se o áudio for silencioso (loudness -inf)
+    
+    Raises:
+        ValueError: Se a saída não contiver o relatório do loudnorm
+    """
+    blocos = re.findall(r'\{[^{}]*"input_i"[^{}]*\}', stderr)
+    if not blocos:
+        raise ValueError('Relatório do loudnorm não encontrado na saída do FFmpeg')
+    relatorio = json.loads(blocos[-1])
+    medicao = {
+        'input_i': float(relatorio['input_i']),
+        'input_lra': float(relatorio['input_lra']),
+        'input_tp': float(relatorio['input_tp']),
+        'input_thresh': float(relatorio['input_thresh']),
+        'target_offset': float(relatorio['target_offset'])
+    }
+    if not all(math.isfinite(v) for v in medicao.values()):
+        return None
+    return medicao
+
+
+def chave_loudness(hash_conteudo, inicio=None, duracao=None):
+    """Chave do cache de medições: mesmo conteúdo, mesmo trecho e mesmos alvos"""
+    alvo = '{I}_{TP}_{LRA}'.format(**LOUDNORM_ALVO)
+    return f'{hash_conteudo}_{inicio or 0:g}_{duracao or 0:g}_{alvo}'
+
+
+def loudness_em_cache(hash_conteudo, inicio=None, duracao=None):
+    """Retorna {'medicao': ...} se este conteúdo/trecho já foi medido, ou None"""
+    return ler_cache('loudness', chave_loudness(hash_conteudo, inicio, duracao))
+
+
+def guardar_loudness(hash_conteudo, inicio, duracao, medicao):
+    """Guarda a medição (None para áudio silencioso) no cache por hash do conteúdo"""
+    gravar_cache('loudness', chave_loudness(hash_conteudo, inicio, duracao), {'medicao': medicao})
+
+
+def medir_loudness(arquivo_entrada, inicio=None, duracao=None, ffmpeg_bin='ffmpeg', hash_conteudo=None):
+    """
+    Mede o loudness (1ª passada do loudnorm), reaproveitando medições anteriores
+    
+    As medições são guardadas pelo hash do conteúdo, então reexportar a mesma
+    fonte para outro formato ou bitrate pula a passada de análise.
+    
+    Returns:
+        Dicionário com as medições, ou None se o áudio for silencioso
+    
+    Raises:
+        RuntimeError: Se o FFmpeg falhar durante a medição
+    """
+    hash_conteudo = hash_conteudo or hash_arquivo(arquivo_entrada)
+    em_cache = loudness_em_cache(hash_conteudo, inicio, duracao)
+    if em_cache is not None:
+        return em_cache.get('medicao')
+    
+    resultado = subprocess.run(
+        comando_medicao_loudness(arquivo_entrada, inicio, duracao, ffmpeg_bin),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    stderr = resultado.stderr.decode('utf-8', errors='ignore')
+    if resultado.returncode != 0:
+        raise RuntimeError(f'Erro ao medir o loudness: {stderr[-500:]}')
+    try:
+        medicao = interpretar_medicao_loudness(stderr)
+    except ValueError as e:
+        raise RuntimeError(str(e))
+    
+    guardar_loudness(hash_conteudo, inicio, duracao, medicao)
+    return medicao
+
+
+def filtro_loudnorm(medicao):
+    """Filtro da 2ª passada do loudnorm, aplicado na própria conversão"""
+    return (
+        'loudnorm=I={I}:TP={TP}:LRA={LRA}'.format(**LOUDNORM_ALVO)
+        + ':measured_I={input_i}:measured_LRA={input_lra}:measured_TP={input_tp}'
+          ':measured_thresh={input_thresh}:offset={target_offset}:linear=true'.format(**medicao)
+    )
+
+
+def duracao_do_probe(probe):
+    """Extrai a duração (em segundos) do resultado de ffmpeg.probe, ou None"""
+    candidatos = [probe.get('format', {}).get('duration')]
+    candidatos += [s.get('duration') for s in probe.get('streams', []) if s.get('codec_type') == 'audio']
+    for valor in candidatos:
+        try:
+            duracao = float(valor)
+        except (TypeError, ValueError):
+            continue
+        if duracao > 0:
+            return duracao
+    return None
+
+
+def montar_conversao(arquivo_entrada, arquivo_saida, formato_saida='m4a', qualidade='192k',
+                     inicio=None, duracao=None, preview=False, bitrate_restrito=False,
+                     loudness=None):
+    """
+    Monta o stream do ffmpeg-python para converter um arquivo de áudio
+    
+    Compartilhado pela linha de comando e pelos servidores (app.py e asgi.py)
+    
+    Args:
+        arquivo_entrada: Caminho do arquivo de entrada
+        arquivo_saida: Caminho do arquivo de saída
+        formato_saida: Formato de saída (chave de FORMATOS_SAIDA, já normalizada)
+        qualidade: Bitrate de áudio - apenas para formatos comprimidos
+        inicio: Início do trecho em segundos (opcional)
+        duracao: Duração do trecho em segundos (opcional)
+        preview: Gera uma prévia curta (PREVIEW_DURACAO) em bitrate baixo
+        bitrate_restrito: Evita que encoders VBR passem do bitrate (modo tamanho alvo)
+        loudness: Medição de medir_loudness; aplica a normalização na mesma codificação
+    
+    Returns:
+        Stream de saída do ffmpeg-python, pronto para ffmpeg.run ou ffmpeg.compile
+    """
+    duracao = limitar_preview(duracao, preview)
+    if preview:
+        qualidade = PREVIEW_QUALIDADE
+    
+    # -ss/-t como opções de entrada: o FFmpeg pula direto para o início do trecho
+    # e para de ler ao final dele, sem decodificar o restante do arquivo
+    input_params = {}
+    if inicio:
+        input_params['ss'] = inicio
+    if duracao:
+        input_params['t'] = duracao
+    
+    # Carrega o arquivo de entrada
+    stream = ffmpeg.input(str(arquivo_entrada), **input_params)
+    
+    # Obtém configurações do formato de saída
+    config = FORMATOS_SAIDA[formato_saida]
+    
+    # Prepara parâmetros de saída
+    output_params = {
+        'acodec': config['acodec'],
+        'ac': 2,  # 2 canais (estéreo)
+        'ar': 44100  # Sample rate de 44.1kHz
+    }
+    
+    # O libopus não aceita 44.1kHz (apenas 8/12/16/24/48kHz)
+    if config['acodec'] == 'libopus':
+        output_params['ar'] = 48000
+    
+    # Adiciona bitrate apenas para formatos comprimidos (não para WAV, FLAC lossless, etc.)
+    formatos_sem_bitrate = {'wav', 'aiff', 'aif', 'flac'}
+    if formato_saida not in formatos_sem_bitrate:
+        output_params['audio_bitrate'] = qualidade
+    
+    # Para FLAC, usa compressão ao invés de bitrate
+    if formato_saida == 'flac':
+        output_params['compression_level'] = 5
+    
+    # 2ª passada do loudnorm fundida à codificação (sem decodificar o arquivo de novo)
+    if loudness:
+        output_params['af'] = filtro_loudnorm(loudness)
+    
+    # Threads do encoder medidas pelo autotune (sem perfil, mantém o padrão do FFmpeg)
+    ajuste = PERFIL_AJUSTE.get(config['acodec'])
+    if ajuste:
+        output_params['threads'] = ajuste['threads']
+    
+    # O libopus usa VBR sem restrição por padrão, o que torna o tamanho final imprevisível
+    if bitrate_restrito and config['acodec'] == 'libopus':
+        output_params['vbr'] = 'constrained'
+    
+    # Extrai o áudio e converte para o formato desejado
+    return ffmpeg.output(stream, str(arquivo_saida), **output_params)
+
+
+# Linha de tempo de CPU escrita pelo FFmpeg com -benchmark
+_BENCHMARK = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+
+def segundos_cpu_benchmark(stderr):
+    """Soma o tempo de CPU (usuário + sistema) informado pelo -benchmark do FFmpeg"""
+    texto = stderr.decode('utf-8', errors='ignore') if isinstance(stderr, bytes) else (stderr or '')
+    return sum(float(utime) + float(stime) for utime, stime in _BENCHMARK.findall(texto))
+
+
+def caminho_saida_padrao(arquivo_entrada, formato_saida, preview=False):
+    """Saída ao lado da entrada, com a extensão do formato (e sufixo _preview na prévia)"""
+    arquivo_base = Path(arquivo_entrada)
+    if preview:
+        arquivo_base = arquivo_base.with_name(f'{arquivo_base.stem}_preview{arquivo_base.suffix}')
+    return arquivo_base.with_suffix(f'.{FORMATOS_SAIDA[formato_saida]["ext"]}')
+
+
+def converter_audio(arquivo_entrada, arquivo_saida=None, formato_saida='m4a', qualidade='192k',
+                    inicio=None, duracao=None, preview=False, tamanho_alvo=None, normalizar=False,
+                    estatisticas=None):
     """
     Converte um arquivo de áudio para outro formato
     
@@ -59,6 +543,12 @@ def converter_audio(arquivo_entrada, arquivo_saida=None, formato_saida='m4a', qu
         arquivo_saida: Caminho do arquivo de saída (opcional)
         formato_saida: Formato de saída (mp3, wav, flac, ogg, aac, m4a, opus, wma, etc.)
         qualidade: Bitrate de áudio (padrão: 192k) - apenas para formatos comprimidos
+        inicio: Início do trecho em segundos (opcional)
+        duracao: Duração do trecho em segundos (opcional)
+        preview: Gera apenas uma prévia curta em bitrate baixo
+        tamanho_alvo: Tamanho máximo da saída em bytes; substitui a qualidade (ignorado na prévia)
+        normalizar: Normaliza o loudness (EBU R128) usando medições em cache quando possível
+        estatisticas: Dicionário opcional que recebe 'segundos_cpu' gastos pelo FFmpeg
     
     Returns:
         True se a conversão foi bem-sucedida, False caso contrário
@@ -84,43 +574,88 @@ def converter_audio(arquivo_entrada, arquivo_saida=None, formato_saida='m4a', qu
     
     # Se não foi especificado arquivo de saída, cria um baseado no nome do arquivo de entrada
     if arquivo_saida is None:
-        arquivo_base = Path(arquivo_entrada)
-        arquivo_saida = arquivo_base.with_suffix(f'.{FORMATOS_SAIDA[formato_saida]["ext"]}')
+        arquivo_saida = caminho_saida_padrao(arquivo_entrada, formato_saida, preview)
+    
+    # A duração (probe) é usada para validar o início e calcular o bitrate do tamanho alvo
+    duracao_total = None
+    if inicio or (tamanho_alvo and not preview):
+        try:
+            duracao_total = duracao_do_probe(ffmpeg.probe(str(arquivo_entrada)))
+        except (ffmpeg.Error, OSError):
+            duracao_total = None
+    try:
+        validar_inicio(inicio, duracao_total)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        return False
+    
+    # Modo tamanho alvo: o bitrate é calculado pela duração do trecho
+    bitrate_alvo = None
+    if tamanho_alvo and not preview:
+        try:
+            bitrate_alvo = calcular_bitrate_alvo(
+                tamanho_alvo, duracao_trecho(duracao_total, inicio, duracao), formato_saida
+            )
+        except ValueError as e:
+            print(f"Erro: {e}")
+            return False
+        qualidade = str(bitrate_alvo)
+    
+    # Normalização: a medição (1ª passada) vem do cache se a fonte já foi analisada
+    loudness = None
+    if normalizar:
+        try:
+            loudness = medir_loudness(arquivo_entrada, inicio, limitar_preview(duracao, preview))
+        except (RuntimeError, OSError) as e:
+            print(f"Erro: {e}")
+            return False
+        if loudness is None:
+            print("Aviso: Áudio silencioso, normalização ignorada")
     
     # Garante que o diretório de saída existe
     os.makedirs(os.path.dirname(arquivo_saida) if os.path.dirname(arquivo_saida) else '.', exist_ok=True)
     
+    def executar(qualidade):
+        # Monta o comando de conversão
+        stream = montar_conversao(arquivo_entrada, arquivo_saida, formato_saida, qualidade,
+                                  inicio=inicio, duracao=duracao, preview=preview,
+                                  bitrate_restrito=bitrate_alvo is not None, loudness=loudness)
+        if estatisticas is not None:
+            stream = stream.global_args('-benchmark')
+        
+        # Executa a conversão (overwrite_output=True sobrescreve arquivos existentes)
+        _, erro = ffmpeg.run(stream, overwrite_output=True, quiet=True)
+        if estatisticas is not None:
+            estatisticas['segundos_cpu'] = estatisticas.get('segundos_cpu', 0.0) + segundos_cpu_benchmark(erro)
+    
     try:
         print(f"Convertendo: {arquivo_entrada} ({formato_entrada or 'desconhecido'}) -> {arquivo_saida} ({formato_saida})")
         
-        # Carrega o arquivo de entrada
-        stream = ffmpeg.input(arquivo_entrada)
-        
-        # Obtém configurações do formato de saída
-        config = FORMATOS_SAIDA[formato_saida]
-        acodec = config['acodec']
-        
-        # Prepara parâmetros de saída
-        output_params = {
-            'acodec': acodec,
-            'ac': 2,  # 2 canais (estéreo)
-            'ar': 44100  # Sample rate de 44.1kHz
-        }
-        
-        # Adiciona bitrate apenas para formatos comprimidos (não para WAV, FLAC lossless, etc.)
-        formatos_sem_bitrate = {'wav', 'aiff', 'aif', 'flac'}
-        if formato_saida not in formatos_sem_bitrate:
-            output_params['audio_bitrate'] = qualidade
+        executar(qualidade)
         
-        # Para FLAC, usa compressão ao invés de bitrate
-        if formato_saida == 'flac':
-            output_params['compression_level'] = 5
-        
-        # Extrai o áudio e converte para o formato desejado
-        stream = ffmpeg.output(stream, arquivo_saida, **output_params)
-        
-        # Executa a conversão (overwrite_output=True sobrescreve arquivos existentes)
-        ffmpeg.run(stream, overwrite_output=True, quiet=True)
+        # 2ª passada apenas se a 1ª ficou fora da tolerância do tamanho alvo
+        if bitrate_alvo:
+            tamanho_obtido = os.path.getsize(arquivo_saida)
+            novo_bitrate = revisar_bitrate_alvo(bitrate_alvo, tamanho_alvo, tamanho_obtido, formato_saida)
+            if novo_bitrate:
+                print(f"Tamanho obtido: {tamanho_obtido} bytes (alvo: {tamanho_alvo}). "
+                      f"Refazendo com {novo_bitrate / 1000:g}k...")
+                executar(str(novo_bitrate))
+                tamanho_obtido = os.path.getsize(arquivo_saida)
+                
+                # Verificação da 2ª passada: se ainda passou do alvo, desce mais um degrau
+                menor_bitrate = tamanho_obtido > tamanho_alvo and reduzir_bitrate_alvo(
+                    novo_bitrate, tamanho_alvo, tamanho_obtido, formato_saida
+                )
+                if menor_bitrate:
+                    print(f"Tamanho obtido: {tamanho_obtido} bytes (alvo: {tamanho_alvo}). "
+                          f"Refazendo com {menor_bitrate / 1000:g}k...")
+                    executar(str(menor_bitrate))
+                    tamanho_obtido = os.path.getsize(arquivo_saida)
+            print(f"Tamanho final: {tamanho_obtido} bytes (alvo: {tamanho_alvo})")
+            if tamanho_obtido > tamanho_alvo:
+                print(f"Erro: {mensagem_tamanho_excedido(tamanho_obtido, tamanho_alvo)}")
+                return False
         
         print(f"✓ Conversão concluída: {arquivo_saida}")
         return True
@@ -133,14 +668,78 @@ def converter_audio(arquivo_entrada, arquivo_saida=None, formato_saida='m4a', qu
         return False
 
 
-def converter_diretorio(diretorio, formato_saida='m4a', qualidade='192k'):
+def paralelismo_do_perfil(formato_saida):
+    """Conversões simultâneas indicadas pelo perfil do autotune para o codec (1 sem perfil)"""
+    config = FORMATOS_SAIDA.get(formato_saida.lower().lstrip('.'))
+    ajuste = PERFIL_AJUSTE.get(config['acodec']) if config else None
+    return ajuste['concorrencia'] if ajuste else 1
+
+
+def agrupar_duplicatas(arquivos):
+    """
+    Agrupa arquivos com conteúdo byte a byte idêntico
+
+    Só arquivos do mesmo tamanho são comparados: primeiro pelo hash parcial
+    (tamanho + primeiro e último bloco) e, se houver colisão, pelo SHA-256
+    completo. Arquivos com tamanho único nem chegam a ser lidos.
+
+    Returns:
+        Lista de grupos (listas de caminhos) na ordem em que os arquivos foram
+        encontrados; o primeiro de cada grupo é o que será convertido
+    """
+    def subdividir(candidatos, funcao_hash):
+        if len(candidatos) < 2:
+            return [candidatos]
+        por_hash = {}
+        for arquivo in candidatos:
+            por_hash.setdefault(funcao_hash(arquivo), []).append(arquivo)
+        return list(por_hash.values())
+
+    grupos = []
+    for mesmo_tamanho in subdividir(arquivos, os.path.getsize):
+        for mesmo_parcial in subdividir(mesmo_tamanho, hash_parcial):
+            grupos.extend(subdividir(mesmo_parcial, hash_arquivo))
+    ordem = {arquivo: i for i, arquivo in enumerate(arquivos)}
+    return sorted(grupos, key=lambda grupo: ordem[grupo[0]])
+
+
+def replicar_saida(origem, destino):
+    """
+    Cria a saída de uma duplicata a partir da saída já convertida
+
+    Usa hardlink (sem ocupar espaço extra) e, se o sistema de arquivos não
+    permitir, copia o arquivo.
+
+    Returns:
+        'hardlink' ou 'cópia'
+    """
+    if os.path.exists(destino):
+        if os.path.samefile(origem, destino):
+            return 'hardlink'
+        os.remove(destino)
+    try:
+        os.link(origem, destino)
+        return 'hardlink'
+    except OSError:
+        shutil.copy2(origem, destino)
+        return 'cópia'
+
+
+def converter_diretorio(diretorio, formato_saida='m4a', qualidade='192k',
+                        inicio=None, duracao=None, preview=False, tamanho_alvo=None,
+                        normalizar=False, trabalhos=None):
     """
     Converte todos os arquivos de áudio de um diretório para o formato especificado
     
+    Arquivos com conteúdo idêntico (cópias com outro nome) são convertidos uma
+    única vez; as demais cópias recebem a saída por hardlink ou cópia.
+    
     Args:
         diretorio: Caminho do diretório
         formato_saida: Formato de saída (mp3, wav, flac, ogg, aac, m4a, etc.)
         qualidade: Bitrate de áudio (padrão: 192k)
+        inicio, duracao, preview, tamanho_alvo, normalizar: Ver converter_audio
+        trabalhos: Conversões simultâneas (padrão: perfil do autotune, ou 1)
     """
     diretorio_path = Path(diretorio)
     
@@ -148,32 +747,114 @@ def converter_diretorio(diretorio, formato_saida='m4a', qualidade='192k'):
         print(f"Erro: Diretório não encontrado: {diretorio}")
         return
     
+    formato_saida = formato_saida.lower().lstrip('.')
+    if formato_saida not in FORMATOS_SAIDA:
+        print(f"Erro: Formato de saída '{formato_saida}' não suportado.")
+        print(f"Formatos suportados: {', '.join(sorted(FORMATOS_SAIDA.keys()))}")
+        return
+    
     # Busca todos os arquivos de áudio no diretório
     arquivos_audio = []
     for ext in FORMATOS_ENTRADA:
         arquivos_audio.extend(diretorio_path.glob(f'*.{ext}'))
         arquivos_audio.extend(diretorio_path.glob(f'*.{ext.upper()}'))
+    # Em sistemas de arquivos sem distinção de maiúsculas, o mesmo arquivo aparece nas duas buscas
+    arquivos_audio = list(dict.fromkeys(arquivos_audio))
     
     if not arquivos_audio:
         print(f"Nenhum arquivo de áudio encontrado em: {diretorio}")
         print(f"Formatos suportados: {', '.join(sorted(FORMATOS_ENTRADA))}")
         return
     
+    trabalhos = trabalhos or paralelismo_do_perfil(formato_saida)
+    grupos = agrupar_duplicatas(arquivos_audio)
+    duplicatas = len(arquivos_audio) - len(grupos)
+    
     print(f"Encontrados {len(arquivos_audio)} arquivo(s) de áudio")
+    if duplicatas:
+        print(f"{duplicatas} cópia(s) com conteúdo idêntico serão reaproveitadas ({len(grupos)} conversão(ões))")
+    if trabalhos > 1:
+        print(f"Convertendo {trabalhos} arquivo(s) por vez")
     print("-" * 50)
     
-    sucessos = 0
-    falhas = 0
+    def converter(grupo):
+        estatisticas = {}
+        sucesso = converter_audio(str(grupo[0]), formato_saida=formato_saida, qualidade=qualidade,
+                                  inicio=inicio, duracao=duracao, preview=preview,
+                                  tamanho_alvo=tamanho_alvo, normalizar=normalizar,
+                                  estatisticas=estatisticas)
+        return sucesso, estatisticas.get('segundos_cpu', 0.0)
+    
+    # Cada conversão é um processo FFmpeg; as threads só aguardam os processos
+    with ThreadPoolExecutor(max_workers=trabalhos) as executor:
+        resultados = list(executor.map(converter, grupos))
+    
+    sucessos = sum(1 for sucesso, _ in resultados if sucesso)
+    falhas = len(resultados) - sucessos
     
-    for arquivo in arquivos_audio:
-        if converter_audio(str(arquivo), formato_saida=formato_saida, qualidade=qualidade):
+    # Duplicatas recebem a saída do arquivo convertido de seu grupo
+    conversoes_evitadas = 0
+    cpu_economizada = 0.0
+    for grupo, (sucesso, segundos_cpu) in zip(grupos, resultados):
+        if len(grupo) == 1:
+            continue
+        if not sucesso:
+            falhas += len(grupo) - 1
+            continue
+        origem = caminho_saida_padrao(grupo[0], formato_saida, preview)
+        for duplicata in grupo[1:]:
+            destino = caminho_saida_padrao(duplicata, formato_saida, preview)
+            try:
+                modo = replicar_saida(origem, destino)
+            except OSError as e:
+                print(f"Erro ao criar {destino}: {e}")
+                falhas += 1
+                continue
+            print(f"✓ Duplicata de {grupo[0].name}: {destino} ({modo})")
             sucessos += 1
-        else:
-            falhas += 1
-        print()
+            conversoes_evitadas += 1
+            cpu_economizada += segundos_cpu
     
     print("-" * 50)
     print(f"Conversão concluída: {sucessos} sucesso(s), {falhas} falha(s)")
+    if conversoes_evitadas:
+        print(f"Deduplicação: {conversoes_evitadas} conversão(ões) evitada(s), "
+              f"~{cpu_economizada:.1f}s de CPU economizados")
+
+
+def _argumento_tempo(valor):
+    """Tipo do argparse para --start"""
+    try:
+        return interpretar_tempo(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _argumento_duracao(valor):
+    """Tipo do argparse para --duration"""
+    try:
+        return interpretar_duracao(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _argumento_tamanho(valor):
+    """Tipo do argparse para --target-size"""
+    try:
+        return interpretar_tamanho(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _argumento_positivo(valor):
+    """Tipo do argparse para -j/--jobs (inteiro maior que zero)"""
+    try:
+        numero = int(valor)
+    except ValueError:
+        numero = 0
+    if numero < 1:
+        raise argparse.ArgumentTypeError(f"Número de conversões inválido: '{valor}'. Use um inteiro maior que zero")
+    return numero
 
 
 def main():
@@ -197,6 +878,18 @@ Exemplos:
   
   # Especificar qualidade de áudio
   python conversor_audio.py arquivo.wav -f mp3 -q 320k
+  
+  # Recortar um trecho (sem decodificar o arquivo inteiro)
+  python conversor_audio.py longo.flac -f mp3 --start 01:00:00 --duration 90
+  
+  # Prévia rápida de 30 segundos em bitrate baixo
+  python conversor_audio.py longo.flac -f mp3 --preview
+  
+  # Caber em um anexo de 8MB (bitrate calculado pela duração)
+  python conversor_audio.py aula.wav -f opus --target-size 8M
+  
+  # Normalizar o loudness (EBU R128); reexportar a mesma fonte reaproveita a medição
+  python conversor_audio.py master.wav -f mp3 --normalize
         """
     )
     
@@ -231,6 +924,47 @@ Exemplos:
         help='Bitrate de áudio (padrão: 192k). Exemplos: 128k, 192k, 256k, 320k'
     )
     
+    parser.add_argument(
+        '--start',
+        dest='inicio',
+        type=_argumento_tempo,
+        help='Início do trecho a converter, em segundos ou HH:MM:SS'
+    )
+    
+    parser.add_argument(
+        '--duration',
+        dest='duracao',
+        type=_argumento_duracao,
+        help='Duração do trecho a converter, em segundos ou HH:MM:SS'
+    )
+    
+    parser.add_argument(
+        '--preview',
+        action='store_true',
+        help=f'Gera apenas uma prévia de {PREVIEW_DURACAO}s em {PREVIEW_QUALIDADE}'
+    )
+    
+    parser.add_argument(
+        '--normalize',
+        dest='normalizar',
+        action='store_true',
+        help='Normaliza o loudness (EBU R128: {I:g} LUFS, {TP:g} dBTP, LRA {LRA:g})'.format(**LOUDNORM_ALVO)
+    )
+    
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='trabalhos',
+        type=_argumento_positivo,
+        help='Conversões simultâneas no modo diretório (padrão: perfil do autotune, ou 1)'
+    )
+    
+    parser.add_argument(
+        '--target-size',
+        dest='tamanho_alvo',
+        type=_argumento_tamanho,
+        help='Tamanho máximo da saída (ex: 8M, 500k); calcula o bitrate e substitui -q'
+    )
+    
     args = parser.parse_args()
     
     # Verifica se foi fornecido um argumento
@@ -255,9 +989,14 @@ Exemplos:
     
     # Processa o diretório ou arquivo único
     if args.diretorio:
-        converter_diretorio(args.entrada, formato_saida=args.formato_saida, qualidade=args.qualidade)
+        converter_diretorio(args.entrada, formato_saida=args.formato_saida, qualidade=args.qualidade,
+                            inicio=args.inicio, duracao=args.duracao, preview=args.preview,
+                            tamanho_alvo=args.tamanho_alvo, normalizar=args.normalizar,
+                            trabalhos=args.trabalhos)
     else:
-        converter_audio(args.entrada, args.saida, formato_saida=args.formato_saida, qualidade=args.qualidade)
+        converter_audio(args.entrada, args.saida, formato_saida=args.formato_saida, qualidade=args.qualidade,
+                        inicio=args.inicio, duracao=args.duracao, preview=args.preview,
+                        tamanho_alvo=args.tamanho_alvo, normalizar=args.normalizar)
 
 
 if __name__ == '__main__':
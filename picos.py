@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Picos de forma de onda (waveform) para o frontend
+
+O áudio é decodificado uma única vez pelo FFmpeg para PCM mono em taxa baixa
+e lido por um pipe em blocos de tamanho fixo. Os mínimos/máximos são
+calculados com NumPy por bloco, então a memória usada não depende da duração
+do arquivo. Cada conteúdo é guardado no cache uma única vez, em
+RESOLUCAO_CACHE buckets, e as resoluções pedidas são reduzidas a partir dele.
+"""
+
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from cache_audio import hash_arquivo, ler_cache, gravar_cache
+
+# Taxa de amostragem (Hz) do PCM mono usado para os picos
+TAXA_PICOS = 8000
+
+# Amostras lidas do pipe por vez
+AMOSTRAS_POR_BLOCO = 65536
+
+RESOLUCAO_PADRAO = 1000
+RESOLUCAO_MAXIMA = 20000
+
+# Resolução guardada no cache (uma entrada por conteúdo, qualquer que seja a resolução pedida)
+RESOLUCAO_CACHE = RESOLUCAO_MAXIMA
+
+# Entradas intermediárias por bucket final (limita a diferença de largura entre buckets a ~6%)
+SUBDIVISOES = 16
+
+# Custo relativo da decodificação para o agendador (mesma escala de conversor_audio.FORMATOS_SAIDA['custo'])
+CUSTO_PICOS = 0.1
+
+CATEGORIA_CACHE = 'picos'
+
+
+def ler_resolucao(valor):
+    """
+    Interpreta o número de buckets pedido
+
+    Raises:
+        ValueError: Se o valor não for um inteiro entre 1 e RESOLUCAO_MAXIMA
+    """
+    if valor is None or str(valor).strip() == '':
+        return RESOLUCAO_PADRAO
+    try:
+        buckets = int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Resolução inválida: '{valor}'")
+    if not 1 <= buckets <= RESOLUCAO_MAXIMA:
+        raise ValueError(f'A resolução deve estar entre 1 e {RESOLUCAO_MAXIMA}')
+    return buckets
+
+
+def comando_decodificacao(caminho, ffmpeg_bin='ffmpeg'):
+    """Comando do FFmpeg que escreve PCM float32 mono em TAXA_PICOS no stdout"""
+    return [
+        ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-i', caminho, '-vn', '-ac', '1', '-ar', str(TAXA_PICOS),
+        '-f', 'f32le', '-acodec', 'pcm_f32le', 'pipe:1'
+    ]
+
+
+class AcumuladorPicos:
+    """
+    Calcula mínimos/máximos por bucket a partir de blocos de amostras
+
+    Como a duração pode ser desconhecida, as amostras são agrupadas em
+    entradas de largura `largura`; quando o número de entradas passa de
+    SUBDIVISOES × buckets, entradas vizinhas são combinadas duas a duas e a
+    largura dobra. A memória fica limitada a O(buckets + bloco).
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.capacidade = max(2, SUBDIVISOES * buckets)
+        self.largura = 1
+        self.total_amostras = 0
+        self._minimos = np.empty(0, dtype=np.float32)
+        self._maximos = np.empty(0, dtype=np.float32)
+        self._resto = np.empty(0, dtype=np.float32)
+        self._bytes_pendentes = b''
+
+    def adicionar_bytes(self, dados):
+        """Adiciona bytes PCM float32 little-endian lidos do pipe"""
+        dados = self._bytes_pendentes + dados
+        util = len(dados) - len(dados) % 4
+        self._bytes_pendentes = dados[util:]
+        if util:
+            self.adicionar(np.frombuffer(dados[:util], dtype='<f4'))
+
+    def adicionar(self, amostras):
+        """Adiciona um bloco de amostras (array float)"""
+        self.total_amostras += len(amostras)
+        amostras = np.concatenate((self._resto, amostras)) if len(self._resto) else amostras
+        completas = len(amostras) - len(amostras) % self.largura
+        if completas:
+            grupos = amostras[:completas].reshape(-1, self.largura)
+            self._minimos = np.concatenate((self._minimos, grupos.min(axis=1)))
+            self._maximos = np.concatenate((self._maximos, grupos.max(axis=1)))
+        self._resto = amostras[completas:].copy()
+
+        while len(self._minimos) > self.capacidade:
+            self._dobrar_largura()
+
+    def _dobrar_largura(self):
+        # Com número ímpar de entradas, a última volta para o resto (ainda menor que a nova largura)
+        # (representada por `largura` amostras sintéticas com o mesmo mínimo e máximo)
+        if len(self._minimos) % 2:
+            ultima = np.full(self.largura, self._minimos[-1], dtype=np.float32)
+            if self.largura > 1:
+                ultima[1] = self._maximos[-1]
+            self._resto = np.concatenate((ultima, self._resto))
+            self._minimos = self._minimos[:-1]
+            self._maximos = self._maximos[:-1]
+        self._minimos = self._minimos.reshape(-1, 2).min(axis=1)
+        self._maximos = self._maximos.reshape(-1, 2).max(axis=1)
+        self.largura *= 2
+
+    def resultado(self):
+        """Retorna (minimos, maximos) com até `buckets` valores cada"""
+        minimos, maximos = self._minimos, self._maximos
+        if len(self._resto):
+            minimos = np.append(minimos, self._resto.min())
+            maximos = np.append(maximos, self._resto.max())
+        minimos, maximos = _reduzir(minimos, maximos, self.buckets)
+        return np.clip(minimos, -1.0, 1.0), np.clip(maximos, -1.0, 1.0)
+
+    def montar_dados(self, hash_conteudo):
+        """Monta o dicionário (serializável em JSON) guardado no cache"""
+        minimos, maximos = self.resultado()
+        return {
+            'hash': hash_conteudo,
+            'buckets': len(minimos),
+            'sample_rate': TAXA_PICOS,
+            'duration': round(self.total_amostras / TAXA_PICOS, 3),
+            'min': np.round(minimos.astype(np.float64), 4).tolist(),
+            'max': np.round(maximos.astype(np.float64), 4).tolist()
+        }
+
+
+def _reduzir(minimos, maximos, buckets):
+    """Combina entradas vizinhas até restarem no máximo `buckets` pares mínimo/máximo"""
+    if len(minimos) <= buckets:
+        return minimos, maximos
+    limites = (np.arange(buckets) * len(minimos)) // buckets
+    return np.minimum.reduceat(minimos, limites), np.maximum.reduceat(maximos, limites)
+
+
+def reduzir_picos(dados, buckets):
+    """Reduz os picos guardados no cache para a resolução pedida"""
+    if dados['buckets'] <= buckets:
+        return dados
+    minimos, maximos = _reduzir(np.asarray(dados['min']), np.asarray(dados['max']), buckets)
+    return {**dados, 'buckets': len(minimos), 'min': minimos.tolist(), 'max': maximos.tolist()}
+
+
+def picos_em_cache(hash_conteudo, buckets):
+    """Retorna os picos já calculados para este conteúdo, na resolução pedida, ou None"""
+    dados = ler_cache(CATEGORIA_CACHE, hash_conteudo)
+    return reduzir_picos(dados, buckets) if dados is not None else None
+
+
+def guardar_picos(dados):
+    """Grava os picos (em RESOLUCAO_CACHE) no cache, indexados pelo hash do conteúdo"""
+    gravar_cache(CATEGORIA_CACHE, dados['hash'], dados)
+
+
+def calcular_picos(caminho, buckets=RESOLUCAO_PADRAO, ffmpeg_bin='ffmpeg', hash_conteudo=None):
+    """
+    Calcula (ou lê do cache) os picos de um arquivo de áudio
+
+    Args:
+        caminho: Arquivo de áudio
+        buckets: Número de pares mínimo/máximo desejados
+        ffmpeg_bin: Binário do FFmpeg
+        hash_conteudo: Hash do conteúdo, se já calculado
+
+    Returns:
+        Dicionário com hash, buckets, sample_rate, duration, min e max
+
+    Raises:
+        RuntimeError: Se o FFmpeg falhar ao decodificar o arquivo
+    """
+    hash_conteudo = hash_conteudo or hash_arquivo(caminho)
+    dados = picos_em_cache(hash_conteudo, buckets)
+    if dados is not None:
+        return dados
+
+    acumulador = AcumuladorPicos(RESOLUCAO_CACHE)
+    # O stderr vai para um arquivo temporário: com dois pipes, um arquivo corrompido que
+    # gere mais erros do que cabem no buffer travaria o FFmpeg e esta thread mutuamente
+    with tempfile.TemporaryFile() as saida_erro:
+        processo = subprocess.Popen(
+            comando_decodificacao(os.path.abspath(caminho), ffmpeg_bin),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=saida_erro
+        )
+        try:
+            for bloco in iter(lambda: processo.stdout.read(AMOSTRAS_POR_BLOCO * 4), b''):
+                acumulador.adicionar_bytes(bloco)
+        finally:
+            processo.stdout.close()
+            processo.wait()
+        saida_erro.seek(0)
+        erro = saida_erro.read(4096).decode('utf-8', errors='ignore')
+
+    if processo.returncode != 0:
+        raise RuntimeError(f'Erro ao decodificar o áudio: {erro[:500]}')
+
+    dados = acumulador.montar_dados(hash_conteudo)
+    guardar_picos(dados)
+    return reduzir_picos(dados, buckets)
+
+
+def picos_binarios(dados):
+    """Codifica os picos como int16 little-endian intercalados (min, max, min, max, ...)"""
+    pares = np.empty(2 * len(dados['min']), dtype='<i2')
+    pares[0::2] = np.round(np.asarray(dados['min']) * 32767)
+    pares[1::2] = np.round(np.asarray(dados['max']) * 32767)
+    return pares.tobytes()